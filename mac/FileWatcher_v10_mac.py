@@ -7,10 +7,16 @@ import time
 import requests
 from PIL import Image, ImageTk
 import io
+import sys
+from pathlib import Path
 from threading import Timer
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# Notifications go through the persistent helper of the universal build
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "universal"))
+from filewatcher.notifiers import HelperNotifier, QueuedNotifier
+
 # Configuration file path
 config_file = os.path.expanduser("~/.FileWatcher_mac.json")
 
@@ -58,6 +64,9 @@ class FileWatcherApp:
         self.remove_button.pack(side=tk.LEFT, padx=5)
 
         # Initialize file monitoring logic
+        # Sent from a thread of its own: a full helper pipe must not hold up
+        # the observer thread
+        self.notifier = QueuedNotifier(HelperNotifier(), fallback=run_osascript)
         self.observer = Observer()
         self.observer.start()
         self.watchers = {}
@@ -173,7 +182,7 @@ class FileWatcherApp:
             )
             if folder_config:
                 event_handler = WatcherHandler(
-                    folder_config.get("excluded_subfolders", [])
+                    folder_config.get("excluded_subfolders", []), self.notifier
                 )
                 watch = self.observer.schedule(
                     event_handler, path, recursive=True)
@@ -190,8 +199,9 @@ class FileWatcherApp:
         self.save_config()  # Now it can access the save_config method
 
 class WatcherHandler(FileSystemEventHandler):
-    def __init__(self, excluded_paths):
+    def __init__(self, excluded_paths, notifier):
         self.excluded_paths = excluded_paths
+        self.notifier = notifier
         self.last_notification_time = {}  # Dictionary to track last notification time per file
         self.notification_delay = 2  # Delay in seconds to debounce notifications
         self.moved_events = {}  # Dictionary to track move events
@@ -260,15 +270,22 @@ class WatcherHandler(FileSystemEventHandler):
         return True
 
     def display_notification(self, message, file_path):
-        # Escaping double quotes in the message
-        escaped_message = message.replace('"', '\\"')
-        subprocess.run(
-            [
-                "osascript",
-                "-e",
-                f'display notification "{escaped_message}" with title "FileWatcher Notification"',
-            ]
-        )
+        # One long-lived helper shows every notification, so a burst costs a
+        # queue put per event instead of starting osascript each time
+        self.notifier.notify("FileWatcher Notification", message, file_path)
+
+
+def run_osascript(title, message, file_path):
+    # Fallback when the helper cannot be started or keeps exiting
+    # Escaping double quotes in the message
+    escaped_message = message.replace('"', '\\"')
+    subprocess.run(
+        [
+            "osascript",
+            "-e",
+            f'display notification "{escaped_message}" with title "{title}"',
+        ]
+    )
 
 # Avanced Settings window
 class EditWatcherDialog(tk.Toplevel):
@@ -336,3 +353,4 @@ if __name__ == "__main__":
     root = tk.Tk()
     app = FileWatcherApp(root)
     root.mainloop()
+    app.notifier.close()
@@ -3,30 +3,37 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, simpledialog, Listbox, Button
 import json
 import os
-import queue
 import subprocess
 import time
 import requests
 from PIL import Image, ImageTk
 import io
+import sys
 from threading import Timer
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 from mac_notifications import client
 from functools import partial
 from pathlib import Path
 
+# The Tk-free watcher engine is shared with the universal build
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "universal"))
+from filewatcher.engine import WatcherEngine
+from filewatcher.history import parse_time
+from filewatcher.metrics import COUNTERS, metrics
+from filewatcher.statcache import stat_cache
+
 # Notifications the way i like them but app needs forced quit?
 
 # https://chat.openai.com/share/2edf89fe-0284-49bc-8307-6321a33b9a97
 
 # Configuration file path
 config_file = os.path.expanduser("~/.LucsNewApp.json")
+# Event journal and its search index
+journal_dir = os.path.expanduser("~/.LucsNewApp-journal")
 
 # Function to open a file in Finder
 def open_in_finder(file_path: str) -> None:
-    # Check if the file exists
-    if not os.path.exists(file_path):
+    # Check if the file exists (cached, the watcher keeps it fresh)
+    if not stat_cache.exists(file_path):
         print(f"The file {file_path} does not exist.")
         return
 
@@ -36,103 +43,46 @@ def open_in_finder(file_path: str) -> None:
         print(f"Error opening file in Finder: {e}")
 
 
-class WatcherHandler(FileSystemEventHandler):
-    def __init__(self, excluded_paths, notification_queue):
-        super().__init__()
-        self.excluded_paths = excluded_paths
-        self.notification_queue = notification_queue
-
-        self.last_notification_time = (
-            {}
-        )  # Dictionary to track last notification time per file
-        self.notification_delay = 2  # Delay in seconds to debounce notifications
-
-    def construct_message(self, event, action):
-        folder_name = os.path.basename(os.path.dirname(event.src_path))
-        file_name = os.path.basename(event.src_path)
-        return f'"{file_name}" in {folder_name} was {action}'
-
-    def on_created(self, event):
-        if self.should_send_notification(event):
-            message = self.construct_message(event, "created")
-            self.queue_notification(message, event.src_path)
-
-    def on_deleted(self, event):
-        if self.should_send_notification(event):
-            message = self.construct_message(event, "deleted")
-            self.queue_notification(message, None)  # No path for deleted files
-
-    def on_modified(self, event):
-        if self.should_send_notification(event):
-            message = self.construct_message(event, "modified")
-            self.queue_notification(message, event.src_path)
-
-    def on_moved(self, event):
-        if self.should_send_notification(event):
-            src_folder = os.path.dirname(event.src_path)
-            dest_folder = os.path.dirname(event.dest_path)
-            src_folder_name = os.path.basename(src_folder)
-            dest_folder_name = os.path.basename(dest_folder)
-            src_file_name = os.path.basename(event.src_path)
-            dest_file_name = os.path.basename(event.dest_path)
-
-            if src_folder == dest_folder:
-                # File is renamed within the same folder
-                message = f'"{src_file_name}" has been renamed to "{dest_file_name}" in {src_folder_name}'
-            else:
-                # File is moved from one folder to another
-                message = f'"{src_file_name}" has been moved from {src_folder_name} to {dest_folder_name}'
-
-            self.queue_notification(message, event.dest_path)
-
-    def should_ignore_event(self, event):
-        # Add logic to ignore certain files (temporary, system files, etc.)
-        ignored_patterns = [".DS_Store", "Thumbs.db", ".tmp", "~$", "._"]
-        if any(event.src_path.endswith(pattern) for pattern in ignored_patterns):
-            return True
-        if os.path.basename(event.src_path).startswith((".", "~")):
-            return True
-        for path in self.excluded_paths:
-            if os.path.commonpath([event.src_path, path]) == path:
-                return True
-        return False
-
-    def should_send_notification(self, event):
-        # Check if the event should be ignored or debounced
-        if self.should_ignore_event(event) or event.is_directory:
-            return False
-        current_time = time.time()
-        last_time = self.last_notification_time.get(event.src_path, 0)
-        if current_time - last_time < self.notification_delay:
-            return False  # Debounce: too soon since the last notification
-        self.last_notification_time[event.src_path] = current_time
-        return True
-
-    def queue_notification(self, message, file_path):
-        # Queue the notification instead of directly displaying it
-        self.notification_queue.put((message, file_path))
-
-
 class FileWatcherApp:
     def __init__(self, root):
         self.root = root
         self.root.title("FileWatcher")
         self.set_app_icon()
 
-        # Creating a thread-safe queue for notifications
-        self.notification_queue = queue.Queue()
+        # Observer, handlers and the thread-safe notification queue live in
+        # the engine, which does not depend on Tk
+        self.engine = WatcherEngine(style="per_event", journal_dir=journal_dir)
+        self.notification_queue = self.engine.notification_queue
+
+        # Process queued notifications in the main thread as soon as the
+        # engine signals its queue's pipe, instead of polling every 100 ms.
+        # Tk on Windows has no file handlers, so it keeps polling there.
+        self.notification_polling = not hasattr(self.root.tk, "createfilehandler")
+        if self.notification_polling:
+            self.root.after(100, self.process_queued_notifications)
+        else:
+            self.root.tk.createfilehandler(
+                self.notification_queue.fileno(),
+                tk.READABLE,
+                lambda fd, mask: self.process_queued_notifications(),
+            )
 
-        # Start a method in the main thread to process queued notifications
-        self.root.after(100, self.process_queued_notifications)
+        # Watchers on the left, event history search on the right
+        main_frame = tk.Frame(root)
+        main_frame.pack(fill=tk.BOTH, expand=True)
 
         # Listview setup
         self.treeview = ttk.Treeview(
-            root, columns=("Name", "Status", "Path"), show="headings"
+            main_frame, columns=("Name", "Status", "Path"), show="headings"
         )
         self.treeview.heading("Name", text="Name")
         self.treeview.heading("Status", text="Status")
         self.treeview.heading("Path", text="Path")
-        self.treeview.pack(fill=tk.BOTH, expand=True)
+        self.treeview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.history_panel = HistoryPanel(main_frame, self.engine)
+        self.history_panel.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
+        self.treeview.bind("<<TreeviewSelect>>", self.on_watcher_selected)
 
         # Buttons setup
         buttons_frame = tk.Frame(root)
@@ -162,17 +112,19 @@ class FileWatcherApp:
         )
         self.remove_button.pack(side=tk.LEFT, padx=5)
 
+        self.diagnostics_button = tk.Button(
+            buttons_frame, text="Diagnostics", command=self.open_diagnostics
+        )
+        self.diagnostics_button.pack(side=tk.RIGHT, padx=5)
+
         # Initialize file monitoring logic
-        self.observer = Observer()
-        self.observer.daemon = True # Set the observer as a daemon thread
-        self.observer.start()
-        
+        self.engine.start()
+
         # Bind the close event uniformly
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.root.bind("<Command-w>", self.on_close)
         self.root.bind("<Command-q>", self.on_close)
 
-        self.watchers = {}
         self.load_config()
 
         # Load watchers into the view and start active watchers
@@ -181,14 +133,28 @@ class FileWatcherApp:
             if folder["status"] == "active":
                 self.add_to_observer(folder["path"])
 
+    def on_watcher_selected(self, event=None):
+        # Search the selected watcher's folder by default
+        selected_item = self.treeview.selection()
+        if selected_item:
+            self.history_panel.under_var.set(
+                self.treeview.item(selected_item[0], "values")[2]
+            )
+
     def process_queued_notifications(self):
-        # Continuously process notifications from the queue
-        while not self.notification_queue.empty():
-            message, file_path = self.notification_queue.get_nowait()
-            self.display_notification(message, file_path)
+        # Display everything that is queued right now
+        started = time.perf_counter_ns()
+        for record in self.notification_queue.drain():
+            title, message, file_path = self.engine.format_notification(record)
+            self.display_notification(title, message, file_path)
+            metrics.count("delivered")
+        metrics.record(
+            "process_queued_notifications", time.perf_counter_ns() - started
+        )
 
-        # Schedule this method to be called again after some time (e.g., 100 ms)
-        self.root.after(100, self.process_queued_notifications)
+        if self.notification_polling:
+            # Schedule this method to be called again after some time (e.g., 100 ms)
+            self.root.after(100, self.process_queued_notifications)
 
     def set_app_icon(self):
         icon_path = "ico.ico"  # The icon file name
@@ -220,6 +186,7 @@ class FileWatcherApp:
                     "path": folder_path,
                     "status": "active",
                     "excluded_subfolders": [],
+                    "ignore_patterns": [],
                 }
             )
             self.save_config()
@@ -263,6 +230,15 @@ class FileWatcherApp:
                 if folder["path"] == folder_path:
                     dialog = EditWatcherDialog(self.root, folder)
                     self.root.wait_window(dialog)
+                    # Recompile the watcher's ignore rules with the new config
+                    self.engine.update_rules(
+                        folder["path"],
+                        folder["excluded_subfolders"],
+                        folder.get("ignore_patterns", []),
+                    )
+                    self.engine.set_content_filter(
+                        folder["path"], folder.get("content_filter", False)
+                    )
                     self.save_config()
                     self.load_watchers_into_view()
 
@@ -279,39 +255,41 @@ class FileWatcherApp:
                 watched_folder["status"] = status
 
     def add_to_observer(self, path):
-        if path not in self.watchers:
-            folder_config = next(
-                (f for f in self.config["watched_folders"]
-                    if f["path"] == path), None
-            )
-            if folder_config:
-                event_handler = WatcherHandler(
+        folder_config = next(
+            (f for f in self.config["watched_folders"]
+                if f["path"] == path), None
+        )
+        if folder_config:
+            self.engine.watch(
+                path,
                 folder_config.get("excluded_subfolders", []),
-                self.notification_queue  # Pass the notification queue
+                folder_config.get("ignore_patterns", []),
+                folder_config.get("quiet_period", 0),
+                folder_config.get("content_filter", False),
             )
-            watch = self.observer.schedule(
-                    event_handler, path, recursive=True)
-            self.watchers[path] = watch
 
     def remove_from_observer(self, path):
-        if path in self.watchers:
-            self.observer.unschedule(self.watchers[path])
-            del self.watchers[path]
+        self.engine.unwatch(path)
 
     def open_edit_dialog(self, watcher):
         dialog = EditWatcherDialog(self.root, watcher)
         self.root.wait_window(dialog)
         self.save_config()  # Now it can access the save_config method
 
-    def display_notification(self, message, file_path):
+    def open_diagnostics(self):
+        DiagnosticsWindow(self.root, self.engine)
+
+    def display_notification(self, title, message, file_path):
         # Using macos-notifications to display a notification
+        started = time.perf_counter_ns()
         client.create_notification(
-            title="FileWatcher Notification",
+            title=title,
             subtitle=message,
             icon=Path(__file__).parent / "icon.png",  # Placeholder for the icon
             action_button_str="Open in Finder",
             action_callback=partial(open_in_finder, file_path=file_path),
         )
+        metrics.record("display_notification", time.perf_counter_ns() - started)
 
     def on_close(self, event=None):
         # Close event logic
@@ -322,14 +300,151 @@ class FileWatcherApp:
     def clean_up(self):
         try:
             # Clean-up logic
-            self.observer.stop()
-            self.observer.join()
+            if not self.notification_polling:
+                self.root.tk.deletefilehandler(self.notification_queue.fileno())
+            self.engine.stop()
             self.save_config()
 
         except Exception as e:
             print(f"Error during shutdown: {e}")
 
 
+# Event history search, next to the watcher list
+class HistoryPanel(tk.Frame):
+    def __init__(self, parent, engine):
+        super().__init__(parent)
+        self.engine = engine
+        self.cursor = None  # Where the next page starts, None when done
+        self.query = None
+
+        # Search fields: folder, and times like "14:00" or "2024-05-01 14:00"
+        fields = tk.Frame(self)
+        fields.pack(fill=tk.X)
+        self.under_var = tk.StringVar()
+        self.since_var = tk.StringVar()
+        self.until_var = tk.StringVar()
+        for column, (label, variable, width) in enumerate(
+            (
+                ("Under:", self.under_var, 24),
+                ("Since:", self.since_var, 10),
+                ("Until:", self.until_var, 10),
+            )
+        ):
+            tk.Label(fields, text=label).grid(row=0, column=column * 2, sticky="w")
+            tk.Entry(fields, textvariable=variable, width=width).grid(
+                row=0, column=column * 2 + 1, sticky="ew"
+            )
+        tk.Button(fields, text="Search", command=self.search).grid(row=0, column=6)
+        fields.grid_columnconfigure(1, weight=1)
+
+        # Results, fetched a page at a time as the list is scrolled down
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL)
+        self.results = ttk.Treeview(
+            self,
+            columns=("Time", "Event", "Path"),
+            show="headings",
+            yscrollcommand=self.on_scroll,
+        )
+        self.results.heading("Time", text="Time")
+        self.results.heading("Event", text="Event")
+        self.results.heading("Path", text="Path")
+        self.results.column("Time", width=140, stretch=False)
+        self.results.column("Event", width=70, stretch=False)
+        self.scrollbar.config(command=self.results.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.results.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.results.bind("<Double-1>", self.open_result)
+
+    def search(self):
+        try:
+            since = parse_time(self.since_var.get()) if self.since_var.get() else None
+            until = parse_time(self.until_var.get()) if self.until_var.get() else None
+        except ValueError:
+            messagebox.showerror("Search", "Use times like 14:00 or 2024-05-01 14:00")
+            return
+        under = self.under_var.get().strip() or None
+        if under:
+            under = os.path.abspath(os.path.expanduser(under))
+        self.query = (under, since, until)
+        self.cursor = None
+        self.results.delete(*self.results.get_children())
+        self.load_page()
+
+    def load_page(self):
+        under, since, until = self.query
+        entries, self.cursor = self.engine.search_history(
+            under, since, until, after=self.cursor
+        )
+        for entry in entries:
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.timestamp))
+            self.results.insert(
+                "",
+                "end",
+                values=(when, entry.kind_name, entry.dest_path or entry.path),
+            )
+
+    def on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # Fetch the next page once the last row comes into view
+        if self.cursor is not None and float(last) >= 1.0:
+            self.load_page()
+
+    def open_result(self, event=None):
+        selected_item = self.results.selection()
+        if selected_item:
+            open_in_finder(self.results.item(selected_item[0], "values")[2])
+
+
+# Pipeline counters and per-stage latencies, refreshed while open
+class DiagnosticsWindow(tk.Toplevel):
+    REFRESH_MS = 1000
+    COLUMNS = ("count", "mean_us", "p50_us", "p99_us", "p999_us", "max_us")
+
+    def __init__(self, parent, engine):
+        super().__init__(parent)
+        self.engine = engine
+        self.title("Diagnostics")
+        self.geometry("700x300")
+
+        self.counters_var = tk.StringVar()
+        tk.Label(self, textvariable=self.counters_var, anchor="w").pack(
+            fill=tk.X, padx=5, pady=5
+        )
+
+        self.stages = ttk.Treeview(
+            self, columns=("Stage",) + self.COLUMNS, show="headings"
+        )
+        self.stages.heading("Stage", text="Stage")
+        for column in self.COLUMNS:
+            self.stages.heading(column, text=column.replace("_us", " (us)"))
+            self.stages.column(column, width=80, anchor="e")
+        self.stages.pack(fill=tk.BOTH, expand=True)
+
+        tk.Button(self, text="Reset", command=metrics.reset).pack(
+            side=tk.RIGHT, padx=5
+        )
+        self.refresh_id = None
+        self.refresh()
+
+    def refresh(self):
+        snapshot = self.engine.pipeline_metrics()
+        counters = snapshot["counters"]
+        self.counters_var.set(
+            "   ".join(f"{name}: {counters.get(name, 0):,}" for name in COUNTERS)
+        )
+        self.stages.delete(*self.stages.get_children())
+        for stage, summary in snapshot["stages"].items():
+            values = [f"{summary['count']:,}"]
+            values += [f"{summary[column]:.1f}" for column in self.COLUMNS[1:]]
+            self.stages.insert("", "end", values=[stage] + values)
+        self.refresh_id = self.after(self.REFRESH_MS, self.refresh)
+
+    def destroy(self):
+        if self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+        super().destroy()
+
+
 # Avanced Settings window
 class EditWatcherDialog(tk.Toplevel):
     def __init__(self, parent, watcher):
@@ -362,12 +477,30 @@ class EditWatcherDialog(tk.Toplevel):
             row=3, column=1, sticky="ew"
         )
 
+        # Glob patterns to ignore, e.g. "*.log, build/*"
+        tk.Label(self, text="Ignore Patterns:").grid(row=4, column=0, sticky="w")
+        self.patterns_var = tk.StringVar(
+            value=", ".join(watcher.get("ignore_patterns", []))
+        )
+        patterns_entry = tk.Entry(self, textvariable=self.patterns_var)
+        patterns_entry.grid(row=4, column=1, sticky="ew")
+
+        # Skip notifications for saves that leave the content unchanged
+        self.content_filter_var = tk.BooleanVar(
+            value=watcher.get("content_filter", False)
+        )
+        tk.Checkbutton(
+            self,
+            text="Only notify when file content changes",
+            variable=self.content_filter_var,
+        ).grid(row=5, column=1, sticky="w")
+
         # OK and Cancel buttons
         tk.Button(self, text="OK", command=self.confirm).grid(
-            row=4, column=1, sticky="ew"
+            row=6, column=1, sticky="ew"
         )
         tk.Button(self, text="Cancel", command=self.destroy).grid(
-            row=5, column=1, sticky="ew"
+            row=7, column=1, sticky="ew"
         )
 
         # Configure the grid
@@ -390,6 +523,12 @@ class EditWatcherDialog(tk.Toplevel):
 
     def confirm(self):
         self.watcher["name"] = self.name_var.get()
+        self.watcher["ignore_patterns"] = [
+            pattern.strip()
+            for pattern in self.patterns_var.get().split(",")
+            if pattern.strip()
+        ]
+        self.watcher["content_filter"] = self.content_filter_var.get()
         self.destroy()
 
 
@@ -1,8 +1,24 @@
+import Foundation
 import UserNotifications
 
 let arguments = CommandLine.arguments
 
-if arguments.count == 4 {
+if arguments.count == 2 && arguments[1] == "--stdin" {
+    // Stay alive and read one JSON message per line until stdin is closed:
+    // {"title": ..., "subtitle": ..., "body": ...}
+    while let line = readLine() {
+        guard let data = line.data(using: .utf8),
+              let message = (try? JSONSerialization.jsonObject(with: data)) as? [String: Any] else {
+            print("Invalid message")
+            continue
+        }
+        scheduleNotification(
+            title: message["title"] as? String ?? "",
+            subtitle: message["subtitle"] as? String ?? "",
+            body: message["body"] as? String ?? ""
+        )
+    }
+} else if arguments.count == 4 {
     let title = arguments[1]
     let subtitle = arguments[2]
     let body = arguments[3]
@@ -1,13 +1,14 @@
 import os
 import json
 import time
+from time import perf_counter_ns
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from queue import Queue
 from threading import Thread
 from plyer import notification
+from filewatcher.engine import WatcherEngine
+from filewatcher.metrics import metrics
+from filewatcher.statcache import stat_cache
 
 # Single Pop-up,
 # Better Formatting
@@ -16,85 +17,6 @@ from plyer import notification
 # AskToQuit
 # Scaling
 
-class FileChangeHandler(FileSystemEventHandler):
-    def __init__(self, app, notification_queue):
-        self.app = app
-        self.notification_queue = notification_queue
-        self.timer_running = False
-        self.timer_id = None  # Initialize timer_id
-
-    def notify_after_delay(self):
-        # Cancel the previous scheduled notification
-        if self.timer_id:
-            self.app.root.after_cancel(self.timer_id)
-            self.timer_id = None
-
-        src_paths = list(self.app.changed_files)
-        self.notification_queue.put(src_paths)
-        self.app.changed_files.clear()
-        self.timer_running = False
-
-    def ignore_file(self, file_path):
-        ignored_files = ['.DS_Store', 'Thumbs.db']
-
-        # Check if the file is hidden
-        if os.name == 'nt':  # For Windows
-            if os.path.basename(file_path).startswith('.'):
-                return True
-        else:
-            if file_path.startswith('.') or file_path.startswith('~$'):
-                return True
-
-        return os.path.basename(file_path) in ignored_files
-
-    def on_modified(self, event):
-        if event.is_directory:
-            return self.on_created(event)
-
-        src_path = event.src_path
-
-        if self.ignore_file(src_path):
-            return
-
-        if src_path not in self.app.changed_files and os.path.getmtime(src_path) != os.path.getctime(src_path):
-            self.app.changed_files.add(src_path)
-
-            if not self.timer_running:
-                # Schedule the notification after a delay
-                self.timer_id = self.app.root.after(1000, self.notify_after_delay)
-                self.timer_running = True
-
-    def on_moved(self, event):
-        # Handle file movements (renaming or moving files/directories)
-        src_path = event.src_path
-
-        if self.ignore_file(src_path):
-            return
-
-        if src_path not in self.app.changed_files:
-            self.app.changed_files.add(src_path)
-
-            if not self.timer_running:
-                # Schedule the notification after a delay
-                self.timer_id = self.app.root.after(1000, self.notify_after_delay)
-                self.timer_running = True
-
-    
-    def on_created(self, event):
-        src_path = event.src_path
-
-        if self.ignore_file(src_path):
-            return
-
-        # Check if it's the initial creation and not an opening
-        if src_path not in self.app.changed_files and os.path.getsize(src_path) > 0:
-            self.app.changed_files.add(src_path)
-
-            if not self.timer_running:
-                # Schedule the notification after a delay
-                self.timer_id = self.app.root.after(1000, self.notify_after_delay)
-                self.timer_running = True
-
 class NotificationHandler(Thread):
     def __init__(self, app, notification_queue):
         super().__init__()
@@ -105,15 +27,18 @@ class NotificationHandler(Thread):
     def run(self):
         while True:
             src_paths = self.notification_queue.get()
-            self.app.show_notification(self.format_notification(src_paths))
+            started = perf_counter_ns()
+            notification_data = self.format_notification(src_paths)
+            shown = perf_counter_ns()
+            self.app.show_notification(notification_data)
+            metrics.count('delivered')
+            finished = perf_counter_ns()
+            metrics.record('process_queued_notifications', finished - started)
+            metrics.record('display_notification', finished - shown)
 
     def format_notification(self, src_paths):
-        app_title = "File Changed:" if len(src_paths) == 1 else "Files changed:"
-
-        if len(src_paths) == 1:
-            return app_title, f"\n{src_paths[0]}"
-        else:
-            return app_title, f"\n" + "\n".join(src_paths)
+        app_title, message, _ = self.app.engine.format_notification(src_paths)
+        return app_title, message
 
 class FileWatcherApp:
     def __init__(self, root):
@@ -121,14 +46,16 @@ class FileWatcherApp:
         self.root.title("Luc's FileWatcher")
         self.watchers = []
         self.config_file = os.path.expanduser("~") + '/watcher_config.json'
-        self.notification_queue = Queue()
-        self.changed_files = set()
+        # Observer, handlers and batching live in the Tk-free engine
+        self.engine = WatcherEngine(style='batched')
+        self.notification_queue = self.engine.notification_queue
+        self.engine.start()
 
         self.notification_handler = NotificationHandler(self, self.notification_queue)
         self.notification_handler.start()
 
         icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ico.ico')
-        if os.path.exists(icon_path):
+        if stat_cache.exists(icon_path):
             root.iconbitmap(icon_path)
         else:
             print("Icon file not found:", icon_path)
@@ -188,34 +115,27 @@ class FileWatcherApp:
         selected_item = self.tree.selection()
         if selected_item:
             index = int(selected_item[0]) - 1
+            self.stop_observer(index)
             del self.watchers[index]
             self.save_config()
             self.update_treeview()
 
     def start_observer(self, index):
-        folder = self.watchers[index]['folder']
-        event_handler = FileChangeHandler(self, self.notification_queue)
-        observer = Observer()
-        observer.schedule(event_handler, folder, recursive=True)
-        observer.start()
-        self.watchers[index]['observer'] = observer
+        self.engine.watch(self.watchers[index]['folder'])
 
     def stop_observer(self, index):
-        try:
-            observer = self.watchers[index]['observer']
-            observer.stop()
-            observer.join()
-        except KeyError:
+        folder = self.watchers[index]['folder']
+        if folder in self.engine.watchers:
+            self.engine.unwatch(folder)
+        else:
             print("Observer is not available or already Inactive")
 
     def show_notification(self, notification_data):
         app_title, message = notification_data
         
+        # Runs on the NotificationHandler thread, so no Tk calls here; the
+        # window icon is set once in __init__
         icon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ico.ico')
-        if os.path.exists(icon_path):
-            root.iconbitmap(icon_path)
-        else:
-            print("Icon file not found:", icon_path)
 
         # Use plyer to display native notifications
         notification.notify(
@@ -269,6 +189,7 @@ class FileWatcherApp:
     def on_close(self):
         if messagebox.askokcancel("Quit Luc's FileWatcher", "Do you really want to quit?\nYou will no longer receive notifications."):
             self.save_config()
+            self.engine.stop()
             self.root.destroy()
 
 if __name__ == "__main__":
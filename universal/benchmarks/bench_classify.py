@@ -0,0 +1,156 @@
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from watchdog.events import FileSystemEventHandler
+
+from filewatcher.aggregate import ShardedAggregator
+from filewatcher.handlers import BaseHandler, FileChangeHandler
+from filewatcher.inotify import InotifyObserver
+
+# Copies a tree into a watched folder, records the events and replays them
+# through the stat-based classification of FileWatcher_v9_uni.py and the
+# flag-based FileChangeHandler. Both run behind BaseHandler.dispatch, like
+# every engine handler; "pipeline only" is that shared per-event cost (stat
+# cache, journal check, dispatch timing) with no classification at all.
+# Each replay is repeated with a fresh handler, the three taking turns, and
+# the median is reported with the fastest and slowest run: single replays of
+# a few hundred ms vary by 10-20% here. Linux only (uses the inotify
+# observer).
+#
+#   python benchmarks/bench_classify.py --files 20000 --repeat 9
+
+
+class Recorder(FileSystemEventHandler):
+    def __init__(self):
+        self.events = []
+        self.last_event = time.monotonic()
+
+    def dispatch(self, event):
+        self.events.append(event)
+        self.last_event = time.monotonic()
+
+
+class StubScheduler:
+    def call_later(self, delay, callback, *args):
+        return None
+
+
+class StubEngine:
+    def __init__(self):
+        self.scheduler = StubScheduler()
+        self.aggregator = ShardedAggregator(self.scheduler, None)
+
+
+class StatClassifier(BaseHandler):
+    # The v9_uni handler logic: a stat per created or modified file
+    def __init__(self):
+        self.changed_files = set()
+
+    ignore_file = FileChangeHandler.ignore_file
+
+    def on_modified(self, event):
+        if event.is_directory:
+            return self.on_created(event)
+        if self.ignore_file(event.src_path):
+            return
+        try:
+            if event.src_path not in self.changed_files and os.path.getmtime(
+                event.src_path
+            ) != os.path.getctime(event.src_path):
+                self.changed_files.add(event.src_path)
+        except OSError:
+            pass
+
+    def on_moved(self, event):
+        if not self.ignore_file(event.src_path):
+            self.changed_files.add(event.src_path)
+
+    def on_created(self, event):
+        if self.ignore_file(event.src_path):
+            return
+        try:
+            if (
+                event.src_path not in self.changed_files
+                and os.path.getsize(event.src_path) > 0
+            ):
+                self.changed_files.add(event.src_path)
+        except OSError:
+            pass
+
+
+def make_tree(root, files, per_dir=500):
+    for i in range(files):
+        directory = os.path.join(root, f"d{i // per_dir}")
+        if i % per_dir == 0:
+            os.makedirs(directory)
+        with open(os.path.join(directory, f"f{i}.txt"), "w") as file:
+            file.write("x" * 512)
+
+
+def record_copy(source, target):
+    observer = InotifyObserver()
+    recorder = Recorder()
+    observer.schedule(recorder, target, recursive=True)
+    observer.start()
+    started = time.perf_counter()
+    shutil.copytree(source, os.path.join(target, "copy"))
+    copied = time.perf_counter() - started
+    while time.monotonic() - recorder.last_event < 0.5:
+        time.sleep(0.1)
+    observer.stop()
+    observer.join()
+    return recorder.events, copied
+
+
+def replay(handler, events):
+    started = time.perf_counter()
+    for event in events:
+        handler.dispatch(event)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    with tempfile.TemporaryDirectory(dir=base) as workdir:
+        source = os.path.join(workdir, "source")
+        target = os.path.join(workdir, "target")
+        os.makedirs(target)
+        make_tree(source, args.files)
+        events, copied = record_copy(source, target)
+        print(f"copied {args.files} files in {copied:.2f}s, {len(events)} events")
+
+        runs = {"pipeline only": [], "stat (v9_uni)": [], "event flags": []}
+        reported = {}
+        for _ in range(args.repeat):
+            runs["pipeline only"].append(replay(BaseHandler(), events))
+            baseline = StatClassifier()
+            runs["stat (v9_uni)"].append(replay(baseline, events))
+            reported["stat (v9_uni)"] = len(baseline.changed_files)
+            engine = StubEngine()
+            handler = FileChangeHandler(engine, None, root=target, close_events=True)
+            runs["event flags"].append(replay(handler, events))
+            reported["event flags"] = len(engine.aggregator)
+
+    print(f"median of {args.repeat} replays, events/s (slowest - fastest run)")
+    for name, times in runs.items():
+        rates = [len(events) / elapsed for elapsed in times]
+        print(
+            f"{name:>14}: {statistics.median(rates):12,.0f}"
+            f" ({min(rates):,.0f} - {max(rates):,.0f}),"
+            f" {reported.get(name, 0)} files reported"
+        )
+
+if __name__ == "__main__":
+    main()
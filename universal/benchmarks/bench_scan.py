@@ -0,0 +1,129 @@
+import argparse
+import os
+import shutil
+import stat
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filewatcher.snapshot import SnapshotScanner, default_workers
+
+# Full-tree snapshot scans of a flat tree (a few huge folders) and a deep
+# tree (many small folders), comparing os.walk() plus lstat() with the
+# parallel SnapshotScanner: a first scan, a rescan (what the rescanner does,
+# every file stat()ed again) and a rescan with verify_files=False that reuses
+# the listings of folders whose mtime did not change. Each row is the median
+# of --repeat runs. The page cache is warm for every run, so the numbers
+# show CPU and syscall cost, not disk latency.
+#
+#   python benchmarks/bench_scan.py
+#   python benchmarks/bench_scan.py --files 500000 --workers 16
+
+
+def make_flat(root, files):
+    # 10 folders of files / 10 files each
+    for i in range(files):
+        directory = os.path.join(root, f"d{i % 10}")
+        if i < 10:
+            os.makedirs(directory)
+        with open(os.path.join(directory, f"f{i}.txt"), "w") as file:
+            file.write("x")
+
+
+def make_deep(root, files):
+    # 8 levels of 4 subfolders, files spread over the leaves and inner folders
+    directories = [root]
+    level = [root]
+    for _ in range(8):
+        level = [
+            os.path.join(parent, f"s{child}") for parent in level for child in range(4)
+        ]
+        if len(directories) + len(level) > files // 4:
+            break
+        for directory in level:
+            os.makedirs(directory)
+        directories += level
+    for i in range(files):
+        directory = directories[i % len(directories)]
+        with open(os.path.join(directory, f"f{i}.txt"), "w") as file:
+            file.write("x")
+
+
+def walk(root):
+    entries = {}
+    for directory, names, files in os.walk(root):
+        for name in names + files:
+            path = os.path.join(directory, name)
+            entries[path] = os.lstat(path)
+    return entries
+
+
+def report(name, files, times):
+    seconds = statistics.median(times)
+    rate = files / seconds if seconds else 0
+    print(f"  {name:<28}{files:>10,}{seconds:>10.3f}{rate:>14,.0f}")
+
+
+def rescans(scanner, root, repeat):
+    # Scans once, then repeat times with the previous result
+    snapshot = scanner.scan(root)
+    times = []
+    for _ in range(repeat):
+        snapshot = scanner.scan(root, previous=snapshot)
+        times.append(scanner.stats.seconds)
+    return times
+
+
+def run(tree, files, workers, repeat):
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    root = tempfile.mkdtemp(dir=base)
+    try:
+        (make_flat if tree == "flat" else make_deep)(root, files)
+        # Listings are only reused once their folder's mtime is safely older
+        # than the scan that cached them
+        time.sleep(1.1)
+        print(f"{tree} tree, {files:,} files, median of {repeat}")
+        print(f"  {'':<28}{'files':>10}{'seconds':>10}{'files/s':>14}")
+
+        times = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            entries = walk(root)
+            times.append(time.perf_counter() - started)
+        found = sum(not stat.S_ISDIR(info.st_mode) for info in entries.values())
+        report("os.walk + lstat", found, times)
+
+        for count in sorted({1, workers}):
+            scanner = SnapshotScanner(count)
+            times = []
+            for _ in range(repeat):
+                scanner.scan(root)
+                times.append(scanner.stats.seconds)
+            label = f"scanner, {count} worker{'s' if count != 1 else ''}"
+            report(label, scanner.stats.files, times)
+            times = rescans(scanner, root, repeat)
+            report("  rescan", scanner.stats.files, times)
+            scanner = SnapshotScanner(count, verify_files=False)
+            times = rescans(scanner, root, repeat)
+            reused = scanner.stats.reused
+            report(f"  rescan, {reused:,} reused", scanner.stats.files, times)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--tree", choices=("flat", "deep"), action="append")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for tree in args.tree or ("flat", "deep"):
+        run(tree, args.files, args.workers, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filewatcher.columnar import ColumnarSnapshot
+from filewatcher.snapshot import SnapshotEntry
+
+# Memory and load time of a large snapshot held as a dict of SnapshotEntry
+# tuples versus a ColumnarSnapshot, built, saved, memory-mapped and queried.
+# Paths look like a home folder of projects: a few hundred thousand folders
+# a few levels deep, with a handful of files each.
+#
+#   python benchmarks/bench_snapshot_store.py
+#   python benchmarks/bench_snapshot_store.py --entries 500000
+
+
+def make_entries(count):
+    entries = {}
+    now = time.time_ns()
+    for i in range(count):
+        directory = (
+            f"/home/user/projects/project{i % 40}/src/package{i // 40 % 50}"
+            f"/module{i // 2000}"
+        )
+        entries[f"{directory}/file_{i}.py"] = SnapshotEntry(
+            1_000_000 + i, i % 65536, now - i * 1_000_000, 0o100644
+        )
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=2_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    entries = make_entries(args.entries)
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    count = len(entries)
+    print(f"{count:,} entries")
+    print(f"  dict of SnapshotEntry      {dict_bytes / 1e6:>10.1f} MB")
+
+    started = time.perf_counter()
+    columnar = ColumnarSnapshot.from_entries(entries)
+    built = time.perf_counter() - started
+    print(
+        f"  columnar                   {columnar.nbytes / 1e6:>10.1f} MB"
+        f"  ({columnar.nbytes / count:.1f} bytes/entry, built in {built:.2f}s)"
+    )
+
+    path = os.path.join(tempfile.mkdtemp(), "snapshot.fws")
+    started = time.perf_counter()
+    columnar.save(path)
+    saved = time.perf_counter() - started
+    print(
+        f"  saved                      {os.path.getsize(path) / 1e6:>10.1f} MB"
+        f"  in {saved:.2f}s"
+    )
+
+    started = time.perf_counter()
+    loaded = ColumnarSnapshot.load(path)
+    loaded_in = time.perf_counter() - started
+    print(f"  load (mmap)                {loaded_in * 1e3:>10.2f} ms")
+
+    keys = random.sample(list(entries), min(args.lookups, count))
+    started = time.perf_counter()
+    for key in keys:
+        if loaded.get(key) is None:
+            raise AssertionError(f"lost {key}")
+    seconds = time.perf_counter() - started
+    print(f"  lookups                    {len(keys) / seconds:>10,.0f} /s")
+
+    started = time.perf_counter()
+    iterated = sum(1 for _ in loaded.items())
+    seconds = time.perf_counter() - started
+    print(f"  full iteration             {iterated / seconds:>10,.0f} entries/s")
+
+    loaded.close()
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    main()
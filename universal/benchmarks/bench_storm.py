@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filewatcher.aggregate import BatchSummary
+from filewatcher.engine import WatcherEngine
+from filewatcher.records import directories
+
+# Filesystem storms on tmpfs, run through the engine with the v14 handler
+# (per_event) and the v9_uni handler (batched). For every notification that
+# reaches notification_queue the latency is measured from the first syscall
+# on that file since its previous notification. Each design/workload pair
+# runs in its own process so CPU time and peak RSS are its own; CPU time
+# includes the workload generating the syscalls.
+#
+#   python benchmarks/bench_storm.py
+#   python benchmarks/bench_storm.py --scale 0.1 --workload creates
+#   python benchmarks/bench_storm.py --workers auto  # decoupled dispatch
+
+STYLES = ("per_event", "batched")
+SETTLE = 2.5  # Seconds without a notification that end a run
+
+
+class TimingQueue:
+    # Stands in for notification_queue and timestamps every put
+    def __init__(self):
+        self.items = []
+        self.lock = Lock()
+        self.last_put = time.perf_counter()
+
+    def put(self, item):
+        now = time.perf_counter()
+        with self.lock:
+            self.items.append((now, item))
+            self.last_put = now
+
+
+class Workload:
+    # prepare() runs before the folder is watched, run() is measured. run()
+    # records every operation with op(path).
+    def __init__(self, root, scale):
+        self.root = root
+        self.scale = scale
+        self.ops = {}  # path -> syscall times, in order
+        self.calls = 0
+
+    def count(self, n):
+        return max(1, int(n * self.scale))
+
+    def op(self, *paths):
+        now = time.perf_counter()
+        self.calls += 1
+        for path in paths:
+            self.ops.setdefault(path, []).append(now)
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+
+class SmallCreates(Workload):
+    # 100k small files, 1000 per folder
+    def prepare(self):
+        for i in range(0, self.count(100_000), 1000):
+            os.makedirs(os.path.join(self.root, f"d{i // 1000}"))
+
+    def run(self):
+        for i in range(self.count(100_000)):
+            path = os.path.join(self.root, f"d{i // 1000}", f"f{i}.txt")
+            self.op(path)
+            with open(path, "w") as file:
+                file.write("x" * 64)
+
+
+class DeepMoves(Workload):
+    # Moves a 20 level deep tree back and forth between two names
+    def prepare(self):
+        directory = os.path.join(self.root, "a")
+        for level in range(20):
+            directory = os.path.join(directory, f"level{level}")
+            os.makedirs(directory)
+            for i in range(5):
+                with open(os.path.join(directory, f"f{i}.txt"), "w") as file:
+                    file.write("x")
+
+    def run(self):
+        names = ("a", "b")
+        for i in range(self.count(200)):
+            src = os.path.join(self.root, names[i % 2])
+            dest = os.path.join(self.root, names[(i + 1) % 2])
+            self.op(src, dest)
+            os.rename(src, dest)
+
+
+class RapidRewrites(Workload):
+    # One file rewritten as fast as possible
+    def prepare(self):
+        with open(os.path.join(self.root, "hot.txt"), "w") as file:
+            file.write("0")
+
+    def run(self):
+        path = os.path.join(self.root, "hot.txt")
+        for i in range(self.count(10_000)):
+            self.op(path)
+            with open(path, "w") as file:
+                file.write(str(i))
+
+
+class MassDeletes(Workload):
+    # Deletes 50k files that existed before the watch started
+    def prepare(self):
+        for i in range(self.count(50_000)):
+            directory = os.path.join(self.root, f"d{i // 1000}")
+            if i % 1000 == 0:
+                os.makedirs(directory)
+            with open(os.path.join(directory, f"f{i}.txt"), "w") as file:
+                file.write("x")
+
+    def run(self):
+        for i in range(self.count(50_000)):
+            path = os.path.join(self.root, f"d{i // 1000}", f"f{i}.txt")
+            self.op(path)
+            os.remove(path)
+
+
+class AtomicSaves(Workload):
+    # Editor saves: write a temporary file, then rename it over the original
+    def prepare(self):
+        for i in range(self.count(2_000)):
+            with open(os.path.join(self.root, f"doc{i}.txt"), "w") as file:
+                file.write("draft")
+
+    def run(self):
+        for save in range(5):
+            for i in range(self.count(2_000)):
+                path = os.path.join(self.root, f"doc{i}.txt")
+                temporary = path + ".tmp"
+                self.op(path, temporary)
+                with open(temporary, "w") as file:
+                    file.write(f"version {save}")
+                os.replace(temporary, path)
+
+
+WORKLOADS = {
+    "creates": SmallCreates,
+    "deep_moves": DeepMoves,
+    "rewrites": RapidRewrites,
+    "deletes": MassDeletes,
+    "atomic_saves": AtomicSaves,
+}
+
+
+def delivered_paths(item):
+    # Candidate paths of a queued notification, most specific first
+    if isinstance(item, BatchSummary):
+        return [
+            [os.path.join(directories.path(dir_id), name)]
+            for dir_id, name in item.keys
+        ]
+    return [[path for path in (item.dest_path, item.path) if path]]
+
+
+def latencies(ops, deliveries):
+    # Time from the first syscall on a file since its previous notification
+    # to the next notification about it
+    cursors = {}
+    results = []
+    for delivered, item in deliveries:
+        for candidates in delivered_paths(item):
+            for path in candidates:
+                times = ops.get(path)
+                start = cursors.get(path, 0)
+                if times and start < len(times) and times[start] <= delivered:
+                    results.append(delivered - times[start])
+                    cursors[path] = bisect_right(times, delivered)
+                    break
+    return sorted(results)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_one(style, name, scale, workers=0):
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    root = tempfile.mkdtemp(dir=base)
+    try:
+        workload = WORKLOADS[name](root, scale)
+        workload.prepare()
+        notifications = TimingQueue()
+        engine = WatcherEngine(
+            style=style, notification_queue=notifications, workers=workers
+        )
+        engine.watch(root)
+        engine.start()
+        time.sleep(0.2)
+
+        cpu_before = time.process_time()
+        started = time.perf_counter()
+        workload.run()
+        ran = time.perf_counter() - started
+        while time.perf_counter() - max(notifications.last_put, started + ran) < SETTLE:
+            time.sleep(0.1)
+        cpu = time.process_time() - cpu_before
+        engine.stop()
+
+        ordered = latencies(workload.ops, notifications.items)
+        result = {
+            "style": style,
+            "workload": name,
+            "ops": workload.calls,
+            "seconds": ran,
+            "notifications": len(notifications.items),
+            "files_reported": len(ordered),
+            "cpu": cpu,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+        if ordered:
+            result["p50_ms"] = percentile(ordered, 0.5) * 1000
+            result["p99_ms"] = percentile(ordered, 0.99) * 1000
+            result["max_ms"] = ordered[-1] * 1000
+        return result
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=1.0, help="workload size")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), action="append")
+    parser.add_argument("--style", choices=STYLES, action="append")
+    parser.add_argument("--workers", default="0", help="dispatch workers or 'auto'")
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        style, name = args.child
+        print(json.dumps(run_one(style, name, args.scale, args.workers)))
+        return
+
+    print(
+        f"{'workload':<13}{'style':<10}{'ops':>8}{'notified':>10}{'files':>8}"
+        f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'cpu s':>7}{'rss MB':>8}"
+    )
+    for name in args.workload or WORKLOADS:
+        for style in args.style or STYLES:
+            output = subprocess.run(
+                [sys.executable, __file__, "--scale", str(args.scale)]
+                + ["--workers", args.workers]
+                + ["--child", style, name],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(
+                f"{name:<13}{style:<10}{result['ops']:>8,}"
+                f"{result['notifications']:>10,}{result['files_reported']:>8,}"
+                f"{result.get('p50_ms', 0):>9.1f}{result.get('p99_ms', 0):>9.1f}"
+                f"{result.get('max_ms', 0):>9.1f}{result['cpu']:>7.2f}"
+                f"{result['peak_rss_mb']:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
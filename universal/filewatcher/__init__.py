@@ -0,0 +1,12 @@
+# Tk-free watcher engine shared by the GUI builds and the headless daemon
+__all__ = ["WatcherEngine"]
+
+
+def __getattr__(name):
+    # Imported on first use, so `python -m filewatcher.<module>` does not
+    # load the engine before running its module
+    if name == "WatcherEngine":
+        from .engine import WatcherEngine
+
+        return WatcherEngine
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,194 @@
+import heapq
+import os
+from threading import Lock
+from time import perf_counter_ns
+
+from .metrics import metrics
+
+MAX_LISTED = 10  # Batches up to this size still list every path
+MAX_GROUPS = 5  # Summary lines in a notification, the rest becomes "+N more"
+BATCH_DELAY = 1.0  # Seconds changes are collected before they are sent
+
+
+def group_label(root, path):
+    # "under src/" for anything below a top-level folder of the watched root,
+    # "in <root name>" for files directly in it
+    relative = path[len(root) + 1 :] if path.startswith(root + os.sep) else path
+    head, sep, _ = relative.partition(os.sep)
+    if sep:
+        return f"under {head}/"
+    return f"in {os.path.basename(root) or root}"
+
+
+class BatchSummary:
+    # Collects the EventRecords of one notification batch. Counts per
+    # (directory, event type) are updated as events arrive, so formatting the
+    # notification takes the same time and produces the same size message for
+    # 5 files or 20,000.
+    def __init__(self):
+        self.keys = set()  # (dir_id, name) of every file in the batch
+        self.listed = []  # The first MAX_LISTED records, in arrival order
+        self.groups = {}  # (label, kind name) -> number of files
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def merge(self, other):
+        # Folds another batch in; group counts of files that were in both
+        # batches are counted twice
+        for record in other.listed:
+            if len(self.listed) >= MAX_LISTED:
+                break
+            if record.key not in self.keys:
+                self.listed.append(record)
+        self.keys |= other.keys
+        for group, files in other.groups.items():
+            self.groups[group] = self.groups.get(group, 0) + files
+
+    def add(self, record, label):
+        key = record.key
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        if len(self.listed) < MAX_LISTED:
+            self.listed.append(record)
+        group = (label, record.kind_name)
+        self.groups[group] = self.groups.get(group, 0) + 1
+        return True
+
+    def format(self):
+        # Returns (title, message, file_path) like the handlers' formatters
+        count = len(self.keys)
+        if count <= MAX_LISTED:
+            app_title = "File Changed:" if count == 1 else "Files changed:"
+            paths = [record.path for record in self.listed]
+            file_path = paths[0] if count == 1 else None
+            return app_title, "\n" + "\n".join(paths), file_path
+
+        top = heapq.nlargest(MAX_GROUPS, self.groups.items(), key=lambda g: g[1])
+        lines = [
+            f"{files:,} {'file' if files == 1 else 'files'} {kind} {label}"
+            for (label, kind), files in top
+        ]
+        remaining = count - sum(files for _, files in top)
+        if remaining > 0:
+            lines.append(f"+{remaining:,} more")
+        return f"{count:,} files changed:", "\n" + "\n".join(lines), None
+
+
+class BatchShard:
+    # One watcher's part of the batch, with its own lock so watchers never
+    # contend with each other
+    __slots__ = ("lock", "summary")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.summary = BatchSummary()
+
+
+class ShardedAggregator:
+    # Collects the batched handlers' changes, one shard per watcher, and puts
+    # them on the notification queue as one BatchSummary a second after the
+    # first change. The flush runs on the scheduler thread and swaps each
+    # shard's summary for an empty one under the shard's lock, so adding a
+    # change never waits for more than another add to the same watcher.
+    def __init__(self, scheduler, notification_queue, delay=BATCH_DELAY):
+        self.scheduler = scheduler
+        self.notification_queue = notification_queue
+        self.delay = delay
+        self.shards = ()  # Replaced, never mutated, so iterating takes no lock
+        self.retired = []  # Summaries of removed shards, sent with the next flush
+        self.scheduled = False
+        self._lock = Lock()  # Guards shards, retired and scheduled
+
+    def __len__(self):
+        return sum(len(shard.summary) for shard in self.shards)
+
+    def shard(self):
+        shard = BatchShard()
+        with self._lock:
+            self.shards += (shard,)
+        return shard
+
+    def remove(self, shard):
+        with self._lock:
+            self.shards = tuple(s for s in self.shards if s is not shard)
+            with shard.lock:
+                summary, shard.summary = shard.summary, BatchSummary()
+            if summary:
+                self.retired.append(summary)
+
+    def add(self, shard, record, label):
+        with shard.lock:
+            added = shard.summary.add(record, label)
+        if added and not self.scheduled:
+            with self._lock:
+                if not self.scheduled:
+                    self.scheduled = True
+                    self.scheduler.call_later(self.delay, self.flush)
+        return added
+
+    def flush(self):
+        # Changes added after scheduled is cleared either make it into this
+        # flush or schedule the next one
+        with self._lock:
+            self.scheduled = False
+            shards = self.shards
+            batches, self.retired = self.retired, []
+        for shard in shards:
+            if shard.summary:
+                with shard.lock:
+                    summary, shard.summary = shard.summary, BatchSummary()
+                batches.append(summary)
+        if not batches:
+            return
+        merged = batches[0]
+        for summary in batches[1:]:
+            merged.merge(summary)
+        started = perf_counter_ns()
+        self.notification_queue.put(merged)
+        metrics.record("queue_notification", perf_counter_ns() - started)
+
+
+class OverflowSummary:
+    # Takes the place of the notifications that did not fit in a full
+    # notification queue (see wakeup.py): per-file records and batches are
+    # folded into one BatchSummary
+    def __init__(self):
+        self.summary = BatchSummary()
+        self.count = 0  # Notifications merged
+
+    def add(self, item):
+        # The queue never merges a RescanNotice, see wakeup.py
+        self.count += 1
+        if isinstance(item, OverflowSummary):
+            self.count += item.count - 1
+            self.summary.merge(item.summary)
+        elif isinstance(item, BatchSummary):
+            self.summary.merge(item)
+        else:
+            label = f"in {os.path.basename(item.directory) or item.directory}"
+            self.summary.add(item, label)
+
+    def format(self):
+        _, message, file_path = self.summary.format()
+        title = f"+{self.count:,} more {'change' if self.count == 1 else 'changes'}"
+        return title, message, file_path
+
+
+class RescanNotice:
+    # Queued when the kernel dropped events of a watcher, and its folder is
+    # being rescanned when rescan_on_overflow is on, see rescan.py
+    def __init__(self, root, rescanning=True):
+        self.root = root
+        self.rescanning = rescanning
+
+    def format(self):
+        name = os.path.basename(self.root) or self.root
+        message = f"Too many changes at once in {name}, some events were lost."
+        if self.rescanning:
+            message += " Rescanning the folder."
+        return "FileWatcher Notification", message, self.root
@@ -0,0 +1,317 @@
+import mmap
+import os
+import sys
+from array import array
+from bisect import bisect_right
+from operator import itemgetter
+from struct import Struct
+
+try:
+    # Optional: column() returns NumPy arrays when it is installed
+    import numpy
+except ImportError:
+    numpy = None
+
+# Compact, read-only storage for snapshots of millions of files. Paths are
+# stored as keys, "folder NUL name", so sorting them keeps the entries of a
+# folder together: a folder's listing is one range of keys and its whole
+# tree two. Keys are sorted and front coded: each one stores how many
+# leading bytes it shares with the previous key and the rest, with a full
+# key every RESTART_EVERY entries for binary search. Stats live in one array
+# per field. A 2M entry snapshot takes about 30 bytes per file plus file
+# names, where a dict of SnapshotEntry tuples takes several hundred.
+#
+# save() writes the arrays as they are in memory, 8-byte aligned, so load()
+# maps the file and reads the columns in place, without parsing.
+MAGIC = b"FWS1"
+VERSION = 2
+RESTART_EVERY = 16
+HEADER = Struct("<4sHHQB7x")  # magic, version, restart interval, count, order
+SECTION = Struct("<QQ")  # offset, length in bytes
+BYTE_ORDERS = ("little", "big")
+SEP = os.fsencode(os.sep)
+NUL = b"\0"  # Between folder and name in a key; never part of a path
+ENCODING = sys.getfilesystemencoding()
+ENCODE_ERRORS = sys.getfilesystemencodeerrors()
+
+# Sections of the file and their array typecodes, in file order
+COLUMNS = (
+    ("inode", "Q"),
+    ("size", "q"),
+    ("mtime_ns", "q"),
+    ("mode", "H"),  # st_mode fits in 16 bits
+    ("shared", "H"),  # Bytes shared with the previous key
+    ("lengths", "H"),  # Bytes stored for the key
+    ("restarts", "Q"),  # Blob offset of every RESTART_EVERY-th key
+)
+ZEROS = (0, 0, 0, 0)  # Stored for an entry without stats
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+def encode(path):
+    # os.fsencode() without its type checks
+    return path.encode(ENCODING, ENCODE_ERRORS)
+
+
+def path_key(path):
+    # "/a/b/c" -> b"/a/b NUL c"
+    folder, _, name = path.rpartition(os.sep)
+    return encode(folder) + NUL + encode(name)
+
+
+def folder_key(directory):
+    # Prefix of the keys of a folder's entries; "/" has the folder ""
+    return encode(directory.rstrip(os.sep)) + NUL
+
+
+def key_path(key):
+    return key.replace(NUL, SEP).decode(ENCODING, ENCODE_ERRORS)
+
+
+def shared_prefix(a, b):
+    # Length of the common prefix, by bisecting on slice comparisons that
+    # run in C instead of comparing byte by byte in Python
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class ColumnarSnapshot:
+    # A read-only {path: (inode, size, mtime_ns, mode)} mapping. Build one
+    # with from_entries() or load().
+    def __init__(self, count, columns, blob, mapping=None):
+        self.count = count
+        self.columns = columns  # name -> array or memoryview
+        self.blob = blob  # Stored path bytes
+        self._mapping = mapping
+        self._restart_keys = None  # Built on the first lookup
+
+    @classmethod
+    def from_entries(cls, entries):
+        # entries: {path: SnapshotEntry}; None values are stored as zeros
+        pairs = [(path_key(path), entry) for path, entry in entries.items()]
+        pairs.sort(key=itemgetter(0))
+        return cls.from_keys(pairs)
+
+    @classmethod
+    def from_keys(cls, pairs):
+        # pairs: (key, stat tuple or None) in key order, from any iterable
+        inodes = array("Q")
+        sizes = array("q")
+        mtimes = array("q")
+        modes = array("H")
+        shared = array("H")
+        lengths = array("H")
+        restarts = array("Q")
+        pieces = []
+        offset = 0
+        count = 0
+        previous = b""
+        folder_end = 0  # Length of the previous key's folder part
+        for key, entry in pairs:
+            if not count % RESTART_EVERY:
+                common = 0
+                restarts.append(offset)
+            elif key[:folder_end] == previous[:folder_end]:
+                common = folder_end  # Same folder, the common case
+            else:
+                common = shared_prefix(key, previous)
+            piece = key[common:]
+            shared.append(common)
+            lengths.append(len(piece))
+            pieces.append(piece)
+            offset += len(piece)
+            previous = key
+            folder_end = key.find(NUL) + 1
+            inode, size, mtime_ns, mode = entry or ZEROS
+            inodes.append(inode)
+            sizes.append(size)
+            mtimes.append(mtime_ns)
+            modes.append(mode)
+            count += 1
+
+        columns = {
+            "inode": inodes,
+            "size": sizes,
+            "mtime_ns": mtimes,
+            "mode": modes,
+            "shared": shared,
+            "lengths": lengths,
+            "restarts": restarts,
+        }
+        return cls(count, columns, b"".join(pieces))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapping)
+        magic, version, restart_every, count, order = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION or restart_every != RESTART_EVERY:
+            raise ValueError(f"Not a version {VERSION} snapshot file: {path}")
+        if BYTE_ORDERS[order] != sys.byteorder:
+            raise ValueError(f"Snapshot file has the wrong byte order: {path}")
+        offset = HEADER.size
+        columns = {}
+        for name, typecode in COLUMNS:
+            start, length = SECTION.unpack_from(view, offset)
+            offset += SECTION.size
+            columns[name] = view[start : start + length].cast(typecode)
+        start, length = SECTION.unpack_from(view, offset)
+        blob = view[start : start + length]
+        return cls(count, columns, blob, mapping)
+
+    def save(self, path):
+        # Written to a temporary file and renamed, so a reader never maps a
+        # half-written snapshot
+        table_size = HEADER.size + SECTION.size * (len(COLUMNS) + 1)
+        sections = []
+        offset = align(table_size)
+        for name, _ in COLUMNS:
+            length = len(self.columns[name]) * self.columns[name].itemsize
+            sections.append((offset, length))
+            offset = align(offset + length)
+        sections.append((offset, len(self.blob)))
+
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as file:
+            order = BYTE_ORDERS.index(sys.byteorder)
+            file.write(HEADER.pack(MAGIC, VERSION, RESTART_EVERY, self.count, order))
+            for section in sections:
+                file.write(SECTION.pack(*section))
+            for (name, _), (start, _) in zip(COLUMNS, sections):
+                file.write(b"\0" * (start - file.tell()))
+                file.write(self.columns[name])
+            file.write(b"\0" * (sections[-1][0] - file.tell()))
+            file.write(self.blob)
+        os.replace(temporary, path)
+
+    def close(self):
+        # Only needed for a loaded snapshot; nothing may use it afterwards
+        if self._mapping is not None:
+            for column in self.columns.values():
+                column.release()
+            self.blob.release()
+            self._mapping.close()
+            self._mapping = None
+            self._restart_keys = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return len(self.blob) + sum(
+            len(column) * column.itemsize for column in self.columns.values()
+        )
+
+    def column(self, name):
+        # A stat column as a NumPy array when NumPy is installed
+        column = self.columns[name]
+        if numpy is None:
+            return column
+        typecode = column.typecode if isinstance(column, array) else column.format
+        return numpy.frombuffer(column, dtype=typecode)
+
+    def entry(self, index):
+        # The stat fields of entry `index` as a tuple (inode, size,
+        # mtime_ns, mode), in SnapshotEntry order
+        columns = self.columns
+        return (
+            columns["inode"][index],
+            columns["size"][index],
+            columns["mtime_ns"][index],
+            columns["mode"][index],
+        )
+
+    def keys(self, start=0):
+        # (index, key) from entry `start` on, decoded from the restart point
+        # before it
+        block = start // RESTART_EVERY
+        index = block * RESTART_EVERY
+        restarts = self.columns["restarts"]
+        if block >= len(restarts):
+            return
+        offset = restarts[block]
+        shared = self.columns["shared"]
+        lengths = self.columns["lengths"]
+        blob = self.blob
+        key = b""
+        while index < self.count:
+            end = offset + lengths[index]
+            key = key[: shared[index]] + bytes(blob[offset:end])
+            offset = end
+            if index >= start:
+                yield index, key
+            index += 1
+
+    def _restart_key(self, block):
+        offset = self.columns["restarts"][block]
+        length = self.columns["lengths"][block * RESTART_EVERY]
+        return bytes(self.blob[offset : offset + length])
+
+    def _from(self, key):
+        # (index, key) of the keys >= key, in order. The restart keys, one in
+        # RESTART_EVERY, are kept as a list so the bisect runs in C.
+        restart_keys = self._restart_keys
+        if restart_keys is None:
+            blocks = range(len(self.columns["restarts"]))
+            restart_keys = self._restart_keys = [
+                self._restart_key(block) for block in blocks
+            ]
+        start = max(0, bisect_right(restart_keys, key) - 1) * RESTART_EVERY
+        for index, found in self.keys(start):
+            if found >= key:
+                yield index, found
+
+    def _range(self, prefix):
+        # (index, key) of every key starting with prefix
+        for index, key in self._from(prefix):
+            if not key.startswith(prefix):
+                return
+            yield index, key
+
+    def get(self, path, default=None):
+        key = path_key(path)
+        for index, found in self._from(key):
+            if found == key:
+                return self.entry(index)
+            break
+        return default
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def items(self):
+        # (path, stat tuple) of every entry, in key order
+        for index, key in self.keys():
+            yield key_path(key), self.entry(index)
+
+    def folder_keys(self, directory):
+        # (index, key) of the entries directly in directory
+        return self._range(folder_key(directory))
+
+    def listing(self, directory):
+        # (path, stat tuple) of the entries directly in directory
+        for index, key in self.folder_keys(directory):
+            yield key_path(key), self.entry(index)
+
+    def tree(self, directory):
+        # (path, stat tuple) of everything below directory: its own entries,
+        # then those of its subfolders, whose keys start with "directory/"
+        yield from self.listing(directory)
+        prefix = encode(directory.rstrip(os.sep)) + SEP
+        for index, key in self._range(prefix):
+            yield key_path(key), self.entry(index)
+
+    def __iter__(self):
+        for path, _ in self.items():
+            yield path
@@ -0,0 +1,137 @@
+import hashlib
+import mmap
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .statcache import stat_cache
+
+try:
+    # Optional: xxhash is much faster than blake2b when it is installed
+    import xxhash
+except ImportError:
+    xxhash = None
+
+MAX_HASH_SIZE = 64 * 1024 * 1024  # Larger files always count as changed
+CHUNK_SIZE = 1024 * 1024
+MAX_ENTRIES = 8192
+
+
+def _new_hasher():
+    if xxhash is not None:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    # Hashes the file through mmap in chunks; hashlib releases the GIL for
+    # each chunk, so several workers hash in parallel
+    hasher = _new_hasher()
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            return hasher.digest()
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, size, chunk_size):
+                    hasher.update(view[offset : offset + chunk_size])
+            finally:
+                view.release()
+    return hasher.digest()
+
+
+class ContentFilter:
+    # Decides on a worker pool whether a modified file really has different
+    # content. Digests are cached by (dev, inode, size, mtime) so metadata-only
+    # events never rehash, and per path to compare against the last content.
+    # Events for a file that is already being hashed are coalesced. There is
+    # no content from before the first check of a path to compare with, so
+    # that check always counts as changed: hashing every watched file up
+    # front would read whole trees. Evicted paths start over the same way.
+    def __init__(self, workers=2, max_size=MAX_HASH_SIZE, max_entries=MAX_ENTRIES):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="filewatcher-hash"
+        )
+        self._lock = Lock()
+        self._by_identity = OrderedDict()  # (dev, ino, size, mtime_ns) -> digest
+        self._by_path = OrderedDict()  # path -> last known digest
+        self._queued = {}  # path -> callback of the latest event
+        self._dirty = set()  # paths that changed again while being hashed
+        self.hashed = 0
+        self.unchanged = 0
+        self.oversized = 0
+
+    def submit(self, path, callback):
+        # callback(path, changed) runs on a worker thread
+        with self._lock:
+            queued = path in self._queued
+            self._queued[path] = callback
+            if queued:
+                self._dirty.add(path)
+                return
+        self._pool.submit(self._run, path)
+
+    def _run(self, path):
+        with self._lock:
+            previous = self._by_path.get(path)
+        while True:
+            with self._lock:
+                self._dirty.discard(path)
+            digest = self.digest(path)
+            with self._lock:
+                if path in self._dirty:
+                    continue
+                callback = self._queued.pop(path)
+                if digest is not None:
+                    self._remember(self._by_path, path, digest)
+            break
+        changed = digest is None or digest != previous
+        if not changed:
+            self.unchanged += 1
+        try:
+            callback(path, changed)
+        except Exception as e:
+            print(f"Error handling {path}: {e}")
+
+    def digest(self, path):
+        # None when the file is gone, unreadable or too large to hash
+        result = stat_cache.stat(path)
+        if result is None:
+            return None
+        if result.st_size > self.max_size:
+            self.oversized += 1
+            return None
+        identity = (result.st_dev, result.st_ino, result.st_size, result.st_mtime_ns)
+        with self._lock:
+            digest = self._by_identity.get(identity)
+        if digest is not None:
+            return digest
+        try:
+            digest = hash_file(path)
+        except (OSError, ValueError):
+            return None
+        self.hashed += 1
+        with self._lock:
+            self._remember(self._by_identity, identity, digest)
+        return digest
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self.max_entries:
+            cache.popitem(last=False)
+
+    def stats(self):
+        return {
+            "hashed": self.hashed,
+            "unchanged": self.unchanged,
+            "oversized": self.oversized,
+            "queued": len(self._queued),
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,125 @@
+import argparse
+import os
+import signal
+import sys
+from time import perf_counter_ns
+
+from .engine import (
+    BACKENDS,
+    HANDLER_STYLES,
+    QUEUE_SIZE,
+    WatcherEngine,
+    resolve_workers,
+)
+from .exporter import MetricsServer
+from .metrics import metrics
+from .notifiers import NOTIFIERS, make_notifier
+from .wakeup import OVERFLOW_POLICIES
+
+# Headless watcher for machines without a display:
+#   python -m filewatcher --config ~/.LucsNewApp.json
+
+
+def run(engine, notifier):
+    # Blocks on the queue, so an idle daemon does not wake up at all
+    while True:
+        item = engine.notification_queue.get()
+        if item is None:
+            break
+        started = perf_counter_ns()
+        title, message, file_path = engine.format_notification(item)
+        shown = perf_counter_ns()
+        try:
+            notifier.notify(title, message, file_path)
+            metrics.count("delivered")
+        except Exception as e:
+            print(f"Error displaying notification: {e}", file=sys.stderr)
+        finished = perf_counter_ns()
+        metrics.record("process_queued_notifications", finished - started)
+        metrics.record("display_notification", finished - shown)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="filewatcher")
+    parser.add_argument(
+        "--config",
+        default=os.path.expanduser("~/.LucsNewApp.json"),
+        help="watcher config (v14 or v9_uni format)",
+    )
+    parser.add_argument("--style", choices=HANDLER_STYLES, default="per_event")
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--notifier", choices=sorted(NOTIFIERS), default="stdout")
+    parser.add_argument("--journal", help="directory to record every event in")
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=QUEUE_SIZE,
+        help="notifications that may wait to be shown, 0 for no limit",
+    )
+    parser.add_argument(
+        "--overflow",
+        choices=OVERFLOW_POLICIES,
+        default="merge",
+        help="what a full queue does with new notifications",
+    )
+    parser.add_argument(
+        "--workers",
+        type=resolve_workers,
+        default=0,
+        help="threads that run the handlers off the observer thread, 'auto' for"
+        " one per core (default 0: on the observer thread)",
+    )
+    parser.add_argument(
+        "--rescan-on-overflow",
+        action="store_true",
+        help="keep a snapshot of every watched tree and rescan it when the"
+        " kernel drops events (inotify only)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve Prometheus text metrics on 127.0.0.1:PORT/metrics",
+    )
+    parser.add_argument(
+        "paths", nargs="*", help="extra folders to watch besides the config"
+    )
+    args = parser.parse_args(argv)
+
+    engine = WatcherEngine(
+        style=args.style,
+        backend=args.backend,
+        journal_dir=args.journal,
+        queue_size=args.queue_size,
+        overflow=args.overflow,
+        workers=args.workers,
+        rescan_on_overflow=args.rescan_on_overflow,
+    )
+    engine.load_config(args.config)
+    engine.watch_active_folders()
+    for path in args.paths:
+        engine.watch(os.path.abspath(path))
+    if not engine.watchers:
+        parser.error("nothing to watch")
+
+    for path, (watches, saved) in engine.watch_counts().items():
+        print(f"Watching {path}: {watches} folders, {saved} excluded", flush=True)
+
+    # Turn SIGTERM into a clean shutdown like Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    notifier = make_notifier(args.notifier)
+    metrics_server = None
+    if args.metrics_port is not None:
+        metrics_server = MetricsServer(engine, args.metrics_port)
+        metrics_server.start()
+        url = f"http://127.0.0.1:{metrics_server.port}/metrics"
+        print(f"Metrics on {url}", flush=True)
+    engine.start()
+    try:
+        run(engine, notifier)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        engine.stop()
+        notifier.close()
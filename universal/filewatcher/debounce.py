@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Paths per second the table debounces exactly; beyond that the oldest entry
+# is evicted early. The table size is this rate times the debounce delay.
+DEBOUNCE_RATE = 2048
+MIN_ENTRIES = 256
+
+
+class Debouncer:
+    # Per-path debounce state with a fixed memory bound. Entries older than
+    # the debounce delay can no longer suppress anything, so they expire;
+    # when the table is full the least recently notified path is evicted.
+    # Evicting an entry can only let one extra notification through.
+    def __init__(self, delay, max_entries=None, clock=time.monotonic):
+        self.delay = delay
+        if max_entries is None:
+            max_entries = max(MIN_ENTRIES, int(delay * DEBOUNCE_RATE))
+        self.max_entries = max_entries
+        self.clock = clock
+        self._last = OrderedDict()  # path -> last notification time, oldest first
+        self._lock = Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._last)
+
+    def allow(self, path):
+        # True when path may notify now; records the notification time
+        now = self.clock()
+        with self._lock:
+            self._expire(now)
+            last = self._last.get(path)
+            if last is not None and now - last < self.delay:
+                return False  # Debounce: too soon since the last notification
+            self._last[path] = now
+            self._last.move_to_end(path)
+            if len(self._last) > self.max_entries:
+                self._last.popitem(last=False)
+                self.evicted += 1
+            return True
+
+    def _expire(self, now):
+        # Times are appended in order, so expired entries sit at the front
+        deadline = now - self.delay
+        last = self._last
+        while last:
+            path, notified_at = next(iter(last.items()))
+            if notified_at > deadline:
+                break
+            del last[path]
+            self.expired += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._last),
+            "max_entries": self.max_entries,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
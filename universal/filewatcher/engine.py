@@ -0,0 +1,392 @@
+import json
+import os
+import sys
+import time
+from threading import Thread
+
+from watchdog.observers import Observer
+
+from . import inotify
+from .aggregate import OverflowSummary, RescanNotice, ShardedAggregator
+from .contenthash import ContentFilter
+from .handlers import FileChangeHandler, WatcherHandler
+from .history import HistoryIndex, Indexer
+from .journal import Journal
+from .metrics import metrics
+from .rescan import Rescanner
+from .rules import IgnoreRules
+from .scheduler import Scheduler
+from .statcache import stat_cache
+from .wakeup import WakeupQueue
+from .workers import DecoupledHandler, DispatchPool, default_workers
+
+# Handler designs the engine can run: "per_event" is the mac v14 handler,
+# "batched" is the universal v9 handler
+HANDLER_STYLES = ("per_event", "batched")
+
+# "inotify" multiplexes all watchers on one fd (Linux only), "watchdog" uses
+# the platform observer from watchdog and "auto" picks inotify when it can
+BACKENDS = ("auto", "inotify", "watchdog")
+
+# Notifications that may wait to be displayed; beyond that the queue applies
+# its overflow policy, see wakeup.py
+QUEUE_SIZE = 1000
+RESCAN_NOTICE_INTERVAL = 30  # Seconds between "events were lost" notices
+
+
+def resolve_workers(workers):
+    # Dispatch workers: 0 runs the handlers on the observer thread, "auto"
+    # sizes the pool by core count, see workers.py
+    if workers == "auto":
+        return default_workers()
+    workers = int(workers)
+    if workers < 0:
+        raise ValueError(f"Invalid worker count: {workers}")
+    return workers
+
+
+def make_observer(backend="auto"):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown observer backend: {backend}")
+    use_inotify = sys.platform.startswith("linux") and inotify.is_supported()
+    if backend == "inotify" or (backend == "auto" and use_inotify):
+        return inotify.InotifyObserver()
+    return Observer()
+
+
+def normalize_config(data):
+    # v14 stores {"watched_folders": [...]}, v9_uni stores a bare list of
+    # {"folder", "status"} entries. Both are read into the v14 layout.
+    if isinstance(data, dict):
+        folders = data.get("watched_folders", [])
+    else:
+        folders = data or []
+
+    watched_folders = []
+    for folder in folders:
+        path = folder.get("path") or folder.get("folder")
+        if not path:
+            continue
+        watched_folders.append(
+            {
+                "name": folder.get("name") or os.path.basename(path),
+                "path": path,
+                "status": str(folder.get("status", "inactive")).lower(),
+                "excluded_subfolders": list(folder.get("excluded_subfolders", [])),
+                "ignore_patterns": list(folder.get("ignore_patterns", [])),
+                "quiet_period": folder.get("quiet_period", 0),
+                "content_filter": bool(folder.get("content_filter", False)),
+            }
+        )
+    return {"watched_folders": watched_folders}
+
+
+class WatcherEngine:
+    # Owns the observer, the event handlers and the notification queue. It
+    # never imports Tk, so it runs the same under the GUI and as a daemon.
+    def __init__(
+        self,
+        style="per_event",
+        notification_queue=None,
+        backend="auto",
+        journal_dir=None,
+        queue_size=QUEUE_SIZE,
+        overflow="merge",
+        workers=0,
+        rescan_on_overflow=False,
+    ):
+        if style not in HANDLER_STYLES:
+            raise ValueError(f"Unknown handler style: {style}")
+        self.style = style
+        if notification_queue is None:
+            # Signals a pipe when it stops being empty, see wakeup.py
+            notification_queue = WakeupQueue(queue_size, overflow)
+        self.notification_queue = notification_queue
+        self.config = {"watched_folders": []}
+        self.config_file = None
+
+        self.scheduler = Scheduler()
+        # Batches of the "batched" style, sharded per watcher
+        self.aggregator = ShardedAggregator(self.scheduler, notification_queue)
+        self.observer = make_observer(backend)
+        self.observer.daemon = True  # Set the observer as a daemon thread
+        # With workers, the observer thread only hands events to the pool
+        workers = resolve_workers(workers)
+        self.dispatch_pool = DispatchPool(workers) if workers else None
+        # Only the inotify observer reports dropped events. With
+        # rescan_on_overflow every watcher keeps a snapshot to rescan against
+        # and recover them, see rescan.py; that costs a scan of the tree per
+        # watch and the snapshot's memory, so it is off by default.
+        self.rescanner = None
+        if isinstance(self.observer, inotify.InotifyObserver):
+            if rescan_on_overflow:
+                self.rescanner = Rescanner(self.observer)
+            self.observer.overflow_callback = self.kernel_overflow
+        self.rescan_notices = {}  # root -> time of its last notice
+        self.watchers = {}
+        self.handlers = {}
+        self.content_filter = None  # Created for the first watcher that uses it
+        # Durable history of every event, see journal.py, and its SQLite
+        # index for searches, updated by its own thread after every commit
+        self.journal = None
+        self.history = None
+        self.indexer = None
+        if journal_dir:
+            self.journal = Journal(journal_dir)
+            self.history = HistoryIndex(journal_dir)
+            self.indexer = Indexer(self.history)
+            self.journal.listeners.append(self.indexer.notify)
+        self.started = False
+
+    @property
+    def handler_class(self):
+        return WatcherHandler if self.style == "per_event" else FileChangeHandler
+
+    def format_notification(self, item):
+        # Returns (title, message, file_path) for a queued notification
+        if isinstance(item, (OverflowSummary, RescanNotice)):
+            return item.format()
+        return self.handler_class.format_notification(item)
+
+    def start(self):
+        if not self.started:
+            self.scheduler.start()
+            if self.dispatch_pool is not None:
+                self.dispatch_pool.start()
+            if self.rescanner is not None:
+                self.rescanner.start()
+            if self.journal is not None:
+                self.indexer.start()
+                self.journal.start()
+            self.observer.start()
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            self.observer.stop()
+            self.observer.join()
+            if self.dispatch_pool is not None:
+                self.dispatch_pool.stop()  # Handles what the observer queued
+            if self.rescanner is not None:
+                self.rescanner.stop()
+            self.scheduler.stop()
+            if self.content_filter is not None:
+                self.content_filter.shutdown()
+            if self.journal is not None:
+                self.journal.close()  # Commits what is still buffered
+                self.indexer.stop()  # Indexes it
+                self.history.close()
+            self.started = False
+
+    def load_config(self, config_file):
+        self.config_file = config_file
+        try:
+            with open(config_file, "r") as file:
+                self.config = normalize_config(json.load(file))
+        except FileNotFoundError:
+            self.config = {"watched_folders": []}
+        except json.decoder.JSONDecodeError:
+            print("Error decoding JSON.")
+            self.config = {"watched_folders": []}
+        return self.config
+
+    def save_config(self):
+        if self.config_file:
+            with open(self.config_file, "w") as file:
+                json.dump(self.config, file, indent=4)
+
+    def watch_active_folders(self):
+        for folder in self.config["watched_folders"]:
+            if folder["status"] == "active":
+                self.watch(
+                    folder["path"],
+                    folder.get("excluded_subfolders", []),
+                    folder.get("ignore_patterns", []),
+                    folder.get("quiet_period", 0),
+                    folder.get("content_filter", False),
+                )
+
+    def get_content_filter(self):
+        # One hashing pool shared by every watcher
+        if self.content_filter is None:
+            self.content_filter = ContentFilter()
+        return self.content_filter
+
+    def make_handler(
+        self,
+        path,
+        excluded_subfolders,
+        ignore_patterns,
+        quiet_period=0,
+        content_filter=False,
+    ):
+        content_filter = self.get_content_filter() if content_filter else None
+        if self.style == "per_event":
+            return WatcherHandler(
+                excluded_subfolders,
+                self.notification_queue,
+                ignore_patterns,
+                scheduler=self.scheduler,
+                quiet_period=quiet_period,
+                content_filter=content_filter,
+            )
+        # Both inotify observers report IN_CLOSE_WRITE as a closed event
+        close_events = sys.platform.startswith("linux")
+        return FileChangeHandler(
+            self,
+            self.notification_queue,
+            root=path,
+            close_events=close_events,
+            content_filter=content_filter,
+        )
+
+    def watch(
+        self,
+        path,
+        excluded_subfolders=(),
+        ignore_patterns=(),
+        quiet_period=0,
+        content_filter=False,
+    ):
+        if path in self.watchers:
+            return self.watchers[path]
+        event_handler = self.make_handler(
+            path, excluded_subfolders, ignore_patterns, quiet_period, content_filter
+        )
+        if self.journal is not None:
+            event_handler.journal = self.journal
+            event_handler.journal_root = path
+        scheduled = event_handler
+        if self.dispatch_pool is not None:
+            scheduled = DecoupledHandler(event_handler, self.dispatch_pool)
+        if isinstance(self.observer, inotify.InotifyObserver):
+            # Excluded subtrees never get a kernel watch at all
+            rules = IgnoreRules(excluded_subfolders, ignore_patterns)
+            watch = self.observer.schedule(
+                scheduled, path, recursive=True, prune=rules.prunes
+            )
+            if self.rescanner is not None:
+                self.rescanner.track(path, event_handler, rules.prunes, watch)
+        else:
+            watch = self.observer.schedule(scheduled, path, recursive=True)
+        self.watchers[path] = watch
+        self.handlers[path] = event_handler
+        return watch
+
+    def update_rules(self, path, excluded_subfolders=(), ignore_patterns=()):
+        # Recompile the ignore rules of a running watcher after a config edit
+        event_handler = self.handlers.get(path)
+        if event_handler is not None and hasattr(event_handler, "update_rules"):
+            event_handler.update_rules(excluded_subfolders, ignore_patterns)
+        if path in self.watchers and isinstance(
+            self.observer, inotify.InotifyObserver
+        ):
+            rules = IgnoreRules(excluded_subfolders, ignore_patterns)
+            self.observer.update_prune(self.watchers[path], rules.prunes)
+            if self.rescanner is not None and event_handler is not None:
+                self.rescanner.track(
+                    path, event_handler, rules.prunes, self.watchers[path]
+                )
+
+    def set_content_filter(self, path, enabled):
+        # Turn content-hash filtering of a running watcher on or off
+        event_handler = self.handlers.get(path)
+        if event_handler is not None:
+            event_handler.content_filter = (
+                self.get_content_filter() if enabled else None
+            )
+
+    def kernel_overflow(self, watches, since):
+        # Called on the observer thread when the kernel dropped events:
+        # rescan the affected watchers, or at least repair their watch trees,
+        # and tell the user
+        metrics.count("kernel_overflows")
+        now = time.monotonic()
+        affected = []
+        for path, watch in list(self.watchers.items()):
+            if watch not in watches:
+                continue
+            if self.rescanner is None:
+                affected.append(watch)
+            elif not self.rescanner.request(path, since):
+                continue
+            # One notice per storm, the rescans themselves are not limited
+            if now - self.rescan_notices.get(path, -RESCAN_NOTICE_INTERVAL) >= (
+                RESCAN_NOTICE_INTERVAL
+            ):
+                self.rescan_notices[path] = now
+                notice = RescanNotice(path, rescanning=self.rescanner is not None)
+                self.notification_queue.put(notice)
+        if affected:
+            Thread(
+                target=self.observer.refresh,
+                args=(affected,),
+                name="filewatcher-refresh",
+                daemon=True,
+            ).start()
+
+    def search_history(self, under=None, since=None, until=None, after=None):
+        # One page of journaled events, newest first: (entries, cursor)
+        if self.history is None:
+            return [], None
+        return self.history.search(under, since, until, after=after)
+
+    def content_filter_stats(self):
+        if self.content_filter is None:
+            return {}
+        return self.content_filter.stats()
+
+    def pipeline_metrics(self):
+        # Counters and per-stage latency percentiles, see metrics.py
+        return metrics.snapshot()
+
+    def queue_stats(self):
+        # Depth and overflow counts of the notification queue
+        stats = {"depth": self.notification_queue.qsize()}
+        if hasattr(self.notification_queue, "overflow_stats"):
+            stats.update(self.notification_queue.overflow_stats())
+        return stats
+
+    def dispatch_stats(self):
+        # Worker count and ring buffer depth; {} when handlers run inline
+        if self.dispatch_pool is None:
+            return {}
+        return self.dispatch_pool.stats()
+
+    def snapshot_stats(self):
+        # {path: files, folders, reused listings and seconds of the last
+        # snapshot scan}, inotify only
+        if self.rescanner is None:
+            return {}
+        return self.rescanner.stats()
+
+    def stat_cache_stats(self):
+        # Hit rate of the process-wide stat cache
+        return stat_cache.stats()
+
+    def debounce_stats(self):
+        # {path: debounce table size and eviction counts} per watcher
+        return {
+            path: handler.debouncer.stats()
+            for path, handler in list(self.handlers.items())
+            if hasattr(handler, "debouncer")
+        }
+
+    def watch_counts(self):
+        # {path: (kernel watches, watches saved by pruning)}, inotify only
+        return {
+            path: (watch.watch_count, watch.saved_watch_count)
+            for path, watch in list(self.watchers.items())
+            if isinstance(watch, inotify.InotifyWatch)
+        }
+
+    def unwatch(self, path):
+        if path in self.watchers:
+            self.observer.unschedule(self.watchers[path])
+            del self.watchers[path]
+            event_handler = self.handlers.pop(path)
+            if self.rescanner is not None:
+                self.rescanner.untrack(path)
+            if isinstance(event_handler, FileChangeHandler):
+                # Its last changes still go out with the next batch
+                self.aggregator.remove(event_handler.shard)
@@ -0,0 +1,196 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from .metrics import metrics
+
+# Serves the engine's metrics in the Prometheus text format on localhost:
+#
+#   python -m filewatcher --metrics-port 9465
+#   curl http://127.0.0.1:9465/metrics
+#
+# Everything is read from state the pipeline already keeps when a scrape
+# comes in; the event path does no extra work. Event rates come from the
+# *_total counters, e.g. rate(filewatcher_events_in_total[1m]).
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Exposition:
+    def __init__(self):
+        self.lines = []
+
+    def metric(self, name, kind, help_text, samples):
+        # samples: [(labels dict, value)] or [(suffix, labels dict, value)]
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+            label_text = ",".join(
+                f'{key}="{escape(label)}"' for key, label in labels.items()
+            )
+            if label_text:
+                label_text = "{" + label_text + "}"
+            self.lines.append(f"{name}{suffix}{label_text} {value}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render(engine):
+    out = Exposition()
+    counts = engine.watch_counts()
+    out.metric(
+        "filewatcher_watches",
+        "gauge",
+        "Kernel watches per watcher.",
+        [({"watcher": path}, watches) for path, (watches, _) in counts.items()],
+    )
+    out.metric(
+        "filewatcher_watches_pruned",
+        "gauge",
+        "Folder watches saved by excluded subfolders and ignore patterns.",
+        [({"watcher": path}, saved) for path, (_, saved) in counts.items()],
+    )
+    out.metric(
+        "filewatcher_watchers",
+        "gauge",
+        "Watched folders.",
+        [({}, len(engine.watchers))],
+    )
+
+    queue = engine.queue_stats()
+    out.metric(
+        "filewatcher_notification_queue_depth",
+        "gauge",
+        "Notifications waiting to be displayed.",
+        [({}, queue["depth"])],
+    )
+    out.metric(
+        "filewatcher_notification_queue_capacity",
+        "gauge",
+        "Bound of the notification queue, 0 when unbounded.",
+        [({}, queue.get("maxsize", 0))],
+    )
+
+    dispatch = engine.dispatch_stats()
+    if dispatch:
+        out.metric(
+            "filewatcher_dispatch_ring_depth",
+            "gauge",
+            "Events waiting for a dispatch worker.",
+            [({}, dispatch["depth"])],
+        )
+        out.metric(
+            "filewatcher_dispatch_full_waits_total",
+            "counter",
+            "Times the observer waited for a full dispatch ring.",
+            [({}, dispatch["full_waits"])],
+        )
+
+    debounce = engine.debounce_stats()
+    out.metric(
+        "filewatcher_debounce_entries",
+        "gauge",
+        "Paths in the debounce table.",
+        [({"watcher": path}, stats["entries"]) for path, stats in debounce.items()],
+    )
+    out.metric(
+        "filewatcher_debounce_evicted_total",
+        "counter",
+        "Debounce entries evicted before they expired.",
+        [({"watcher": path}, stats["evicted"]) for path, stats in debounce.items()],
+    )
+
+    counters = engine.pipeline_metrics()["counters"]
+    for name, value in counters.items():
+        out.metric(
+            f"filewatcher_{name}_total",
+            "counter",
+            f"Pipeline counter {name}.",
+            [({}, value)],
+        )
+
+    samples = []
+    for stage, histogram in metrics.merged().histograms.items():
+        labels = {"stage": stage}
+        for quantile in QUANTILES:
+            value = histogram.percentile(quantile) / 1e9
+            samples.append(("", {**labels, "quantile": quantile}, value))
+        samples.append(("_sum", labels, histogram.total / 1e9))
+        samples.append(("_count", labels, histogram.count))
+    out.metric(
+        "filewatcher_stage_latency_seconds",
+        "summary",
+        "Latency of each pipeline stage; display_notification is the"
+        " notification backend.",
+        samples,
+    )
+
+    snapshots = engine.snapshot_stats()
+    out.metric(
+        "filewatcher_snapshot_files",
+        "gauge",
+        "Files in the last overflow snapshot scan of each watcher.",
+        [({"watcher": path}, stats["files"]) for path, stats in snapshots.items()],
+    )
+    out.metric(
+        "filewatcher_snapshot_scan_seconds",
+        "gauge",
+        "Wall time of the last overflow snapshot scan of each watcher.",
+        [({"watcher": path}, stats["seconds"]) for path, stats in snapshots.items()],
+    )
+
+    cache = engine.stat_cache_stats()
+    out.metric(
+        "filewatcher_stat_cache_hits_total",
+        "counter",
+        "Stat cache hits.",
+        [({}, cache["hits"])],
+    )
+    out.metric(
+        "filewatcher_stat_cache_misses_total",
+        "counter",
+        "Stat cache misses.",
+        [({}, cache["misses"])],
+    )
+    return out.text()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render(self.server.engine).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # No log line per scrape
+
+
+class MetricsServer(Thread):
+    # Binds to 127.0.0.1 only; scrapes are served on their own threads
+    def __init__(self, engine, port, host="127.0.0.1"):
+        super().__init__(name="filewatcher-metrics", daemon=True)
+        self.server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        self.server.daemon_threads = True
+        self.server.engine = engine
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
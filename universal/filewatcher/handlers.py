@@ -0,0 +1,322 @@
+import os
+from threading import Lock
+from time import perf_counter_ns
+
+from watchdog.events import FileSystemEventHandler
+
+from .aggregate import group_label
+from .debounce import Debouncer
+from .metrics import metrics
+from .records import CREATED, DELETED, MODIFIED, MOVED, EventRecord
+from .rules import IgnoreRules
+from .statcache import stat_cache
+
+MAX_PENDING_CREATES = 10000  # New files still open for writing
+
+
+class BaseHandler(FileSystemEventHandler):
+    # Set by the engine when events are journaled: the Journal and the
+    # watcher root the events are recorded under
+    journal = None
+    journal_root = ""
+    # The watcher's Snapshot while overflow rescans are enabled, see rescan.py
+    snapshot = None
+
+    def dispatch(self, event):
+        if self.snapshot is not None:
+            self.snapshot.apply(event)
+        self.deliver(event)
+
+    def deliver(self, event):
+        # dispatch() without updating the snapshot, for the changes a rescan
+        # recovered: its new snapshot already has them
+        # An event means any cached stat of its paths is stale
+        stat_cache.invalidate(event.src_path, event.dest_path)
+        if self.journal is not None:
+            self.journal.append_event(self.journal_root, event)
+        started = perf_counter_ns()
+        # Called directly rather than through super(), this runs per event
+        FileSystemEventHandler.dispatch(self, event)
+        metrics.record("dispatch", perf_counter_ns() - started)
+
+
+class WatcherHandler(BaseHandler):
+    # One notification per event, debounced per file (the mac v14 design)
+    def __init__(
+        self,
+        excluded_paths,
+        notification_queue,
+        ignore_patterns=(),
+        scheduler=None,
+        quiet_period=0,
+        content_filter=None,
+    ):
+        super().__init__()
+        self.rules = IgnoreRules(excluded_paths, ignore_patterns)
+        self.notification_queue = notification_queue
+
+        self.notification_delay = 2  # Delay in seconds to debounce notifications
+        # Bounded table tracking the last notification time per file
+        self.debouncer = Debouncer(self.notification_delay)
+
+        # With a quiet period, a file only notifies once it has seen no events
+        # for that many seconds, and reports its last event
+        self.scheduler = scheduler
+        self.quiet_period = quiet_period if scheduler is not None else 0
+        self.quiet_timers = {}  # (dir_id, name) -> (timer, token, record)
+        self.quiet_lock = Lock()
+
+        # Optional ContentFilter: modifications only notify when the file's
+        # content hash differs from the last one seen
+        self.content_filter = content_filter
+
+    @staticmethod
+    def format_notification(record):
+        # Messages are built when the record is displayed, not on the
+        # observer thread
+        if record.kind == MOVED:
+            src_folder_name = os.path.basename(record.directory)
+            dest_folder_name = os.path.basename(record.dest_directory)
+            if record.dir_id == record.dest_dir_id:
+                # File is renamed within the same folder
+                message = f'"{record.name}" has been renamed to "{record.dest_name}" in {src_folder_name}'
+            else:
+                # File is moved from one folder to another
+                message = f'"{record.name}" has been moved from {src_folder_name} to {dest_folder_name}'
+            return "FileWatcher Notification", message, record.dest_path
+
+        folder_name = os.path.basename(record.directory)
+        message = f'"{record.name}" in {folder_name} was {record.kind_name}'
+        # No path for deleted files
+        file_path = None if record.kind == DELETED else record.path
+        return "FileWatcher Notification", message, file_path
+
+    def on_created(self, event):
+        if self.should_send_notification(event):
+            self.queue_notification(EventRecord.create(event.src_path, CREATED))
+
+    def on_deleted(self, event):
+        if self.should_send_notification(event):
+            self.queue_notification(EventRecord.create(event.src_path, DELETED))
+
+    def on_modified(self, event):
+        if self.content_filter is not None:
+            # Hashed off the observer thread, debounced once it has changed
+            if not (event.is_directory or self.should_ignore_event(event)):
+                self.content_filter.submit(event.src_path, self.content_checked)
+            return
+        if self.should_send_notification(event):
+            self.queue_notification(EventRecord.create(event.src_path, MODIFIED))
+
+    def content_checked(self, path, changed):
+        # Runs on a ContentFilter worker
+        if not changed:
+            return
+        if self.quiet_period or self.debouncer.allow(path):
+            self.queue_notification(EventRecord.create(path, MODIFIED))
+        else:
+            metrics.count("debounced")
+
+    def on_moved(self, event):
+        if self.should_send_notification(event):
+            self.queue_notification(
+                EventRecord.create(event.src_path, MOVED, event.dest_path)
+            )
+
+    def update_rules(self, excluded_paths, ignore_patterns=()):
+        # Called when the watcher config changes; swapping the attribute is
+        # atomic, so the observer thread never sees a half-built matcher
+        self.rules = IgnoreRules(excluded_paths, ignore_patterns)
+
+    def should_ignore_event(self, event):
+        # Temporary/system files, user globs and excluded subfolders
+        started = perf_counter_ns()
+        ignored = self.rules.matches(event.src_path)
+        metrics.record("should_ignore_event", perf_counter_ns() - started)
+        if ignored:
+            metrics.count("ignored")
+        return ignored
+
+    def should_send_notification(self, event):
+        # Check if the event should be ignored or debounced
+        started = perf_counter_ns()
+        if self.should_ignore_event(event) or event.is_directory:
+            send = False
+        elif self.quiet_period:
+            send = True  # Debounced by the quiet period timer instead
+        else:
+            send = self.debouncer.allow(event.src_path)
+            if not send:
+                metrics.count("debounced")
+        metrics.record("should_send_notification", perf_counter_ns() - started)
+        return send
+
+    def queue_notification(self, record):
+        # Queue the notification instead of directly displaying it
+        started = perf_counter_ns()
+        if self.quiet_period:
+            self.hold_until_quiet(record)
+        else:
+            self.notification_queue.put(record)
+        metrics.record("queue_notification", perf_counter_ns() - started)
+
+    def hold_until_quiet(self, record):
+        # Every event restarts the path's timer; cancelling is O(1) on the wheel
+        token = object()
+        key = record.key
+        with self.quiet_lock:
+            pending = self.quiet_timers.get(key)
+            if pending is not None:
+                self.scheduler.cancel(pending[0])
+            timer = self.scheduler.call_later(
+                self.quiet_period, self.release_quiet, key, token
+            )
+            self.quiet_timers[key] = (timer, token, record)
+
+    def release_quiet(self, key, token):
+        with self.quiet_lock:
+            pending = self.quiet_timers.get(key)
+            # A timer that fired while it was being replaced is stale
+            if pending is None or pending[1] is not token:
+                return
+            del self.quiet_timers[key]
+        self.notification_queue.put(pending[2])
+
+
+class FileChangeHandler(BaseHandler):
+    # Changes are collected for a second and sent as one notification (the
+    # universal v9 design), in this handler's shard of the engine's
+    # ShardedAggregator.
+    #
+    # Events are classified from the kernel event flags alone, without any
+    # stat on the observer thread. When the backend reports IN_CLOSE_WRITE
+    # (close_events), a new file is reported once it is closed after being
+    # written to; otherwise creations and modifications are reported as is.
+    def __init__(
+        self,
+        engine,
+        notification_queue,
+        root="",
+        close_events=False,
+        content_filter=None,
+    ):
+        super().__init__()
+        self.engine = engine
+        self.notification_queue = notification_queue
+        self.root = root
+        self.close_events = close_events
+        self.content_filter = content_filter  # Optional, see WatcherHandler
+        self.pending_creates = {}  # path -> written since it was created
+        self.shard = engine.aggregator.shard()
+
+    @staticmethod
+    def format_notification(summary):
+        # Lists small batches, summarises large ones per directory
+        return summary.format()
+
+    def add_change(self, record, src_path):
+        label = group_label(self.root, src_path)
+        if self.engine.aggregator.add(self.shard, record, label):
+            metrics.count("batched")
+
+    def ignore_file(self, file_path):
+        ignored_files = [".DS_Store", "Thumbs.db"]
+
+        # Check if the file is hidden
+        if os.name == "nt":  # For Windows
+            if os.path.basename(file_path).startswith("."):
+                metrics.count("ignored")
+                return True
+        else:
+            if file_path.startswith(".") or file_path.startswith("~$"):
+                metrics.count("ignored")
+                return True
+
+        if os.path.basename(file_path) in ignored_files:
+            metrics.count("ignored")
+            return True
+        return False
+
+    def on_modified(self, event):
+        if event.is_directory:
+            return self.on_created(event)
+
+        src_path = event.src_path
+
+        if self.close_events and not event.is_synthetic:
+            # Reported once it is closed; only note that a new file got
+            # content, which an attribute change (touch) does not give it
+            if src_path in self.pending_creates and not getattr(
+                event, "is_attrib", False
+            ):
+                self.pending_creates[src_path] = True
+            return
+
+        if self.ignore_file(src_path):
+            return
+
+        self.add_modified(src_path)
+
+    def add_modified(self, src_path):
+        if self.content_filter is not None:
+            self.content_filter.submit(src_path, self.content_checked)
+        else:
+            self.add_change(EventRecord.create(src_path, MODIFIED), src_path)
+
+    def content_checked(self, src_path, changed):
+        # Runs on a ContentFilter worker
+        if changed:
+            self.add_change(EventRecord.create(src_path, MODIFIED), src_path)
+
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE: a new file with content is "created", anything
+        # else that was written to is "modified"
+        src_path = event.src_path
+
+        if self.ignore_file(src_path):
+            return
+
+        written = self.pending_creates.pop(src_path, None)
+        if written is None:
+            self.add_modified(src_path)
+        elif written:
+            self.add_change(EventRecord.create(src_path, CREATED), src_path)
+
+    def on_moved(self, event):
+        # Handle file movements (renaming or moving files/directories)
+        src_path = event.src_path
+
+        if self.ignore_file(src_path):
+            return
+
+        record = EventRecord.create(src_path, MOVED, event.dest_path)
+        self.add_change(record, src_path)
+
+    def on_deleted(self, event):
+        self.pending_creates.pop(event.src_path, None)
+
+    def on_created(self, event):
+        src_path = event.src_path
+
+        if self.ignore_file(src_path):
+            return
+
+        # A synthetic event is a file found in a new folder, its writes and
+        # close may have happened before the folder was watched
+        synthetic = getattr(event, "is_synthetic", False)
+        if event.is_directory or synthetic or not self.close_events:
+            self.add_change(EventRecord.create(src_path, CREATED), src_path)
+            return
+
+        # Wait for the close to tell an initial creation with content from
+        # an empty file being opened or touched
+        self.pending_creates[src_path] = False
+        if len(self.pending_creates) > MAX_PENDING_CREATES:
+            # With decoupled dispatch other workers may change the dict
+            # meanwhile, see workers.py
+            try:
+                oldest = next(iter(self.pending_creates))
+            except RuntimeError:
+                return
+            if self.pending_creates.pop(oldest, None) is not None:
+                metrics.count("dropped")
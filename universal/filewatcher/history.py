@@ -0,0 +1,349 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from threading import Condition, Lock, Thread, local
+
+from .journal import NO_STRING, JournalEntry, JournalReader
+
+# SQLite index over the event journal, kept in the journal directory. Events
+# are indexed by minute bucket and by directory, so "what changed under
+# ~/projects/api between 14:00 and 15:00" reads a small index range instead
+# of every record. The index follows the journal: catch_up() copies the
+# records written since the last call in batched transactions, and drops the
+# rows of segments the journal's retention deleted. Directories are stored
+# once in their own table, events refer to them by id.
+#
+#   python -m filewatcher.history ~/.filewatcher/journal \
+#       --under ~/projects/api --since 14:00 --until 15:00
+DATABASE_FILE = "history.sqlite3"
+BUCKET_SECONDS = 60
+BATCH_SIZE = 5000  # Records per insert transaction
+PAGE_SIZE = 100
+
+SCHEMA_VERSION = 2  # An index of another version is rebuilt
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    bucket INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    kind INTEGER NOT NULL,
+    watcher INTEGER NOT NULL,
+    directory INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    dest_directory INTEGER,
+    dest_name TEXT
+);
+CREATE INDEX IF NOT EXISTS events_by_bucket ON events (bucket);
+CREATE INDEX IF NOT EXISTS events_by_directory ON events (directory, bucket);
+CREATE INDEX IF NOT EXISTS events_by_destination ON events (dest_directory)
+    WHERE dest_directory IS NOT NULL;
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    first_id INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    segment TEXT NOT NULL,
+    records INTEGER NOT NULL
+);
+"""
+OLD_TABLES = ("events", "segments", "progress", "directories")
+
+# Directories at or below a folder; the range uses the unique index, the
+# substr() test drops siblings such as "api-old" that sort inside it
+SUBTREE = (
+    "SELECT id FROM directories WHERE path >= ? AND path < ?"
+    " AND (path = ? OR substr(path, ?, 1) = ?)"
+)
+
+
+class HistoryIndex:
+    # Every thread gets its own connection; WAL mode lets the GUI query while
+    # the journal thread inserts. close() closes all of them.
+    def __init__(self, journal_dir, database=None):
+        self.journal_dir = journal_dir
+        self.database = database or os.path.join(journal_dir, DATABASE_FILE)
+        self.reader = JournalReader(journal_dir)
+        self._local = local()
+        self._connections = []
+        self._connections_lock = Lock()
+        self._write_lock = Lock()
+        self._directory_ids = {}  # path -> id in directories, never changes
+        with self._write_lock:
+            connection = self.connection()
+            connection.execute("BEGIN IMMEDIATE")
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                # The index only holds what the journal has, so start over
+                for table in OLD_TABLES:
+                    connection.execute(f"DROP TABLE IF EXISTS {table}")
+                connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    connection.execute(statement)
+            connection.execute("COMMIT")
+
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or connection not in self._connections:
+            # Only used by this thread, but closed by whichever calls close()
+            connection = sqlite3.connect(
+                self.database, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def catch_up(self):
+        # Indexes everything committed to the journal since the last call and
+        # returns the number of new events. Safe to run from several
+        # processes: progress is read and advanced under SQLite's write lock.
+        connection = self.connection()
+        added = 0
+        while True:
+            with self._write_lock:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    row = connection.execute(
+                        "SELECT segment, records FROM progress"
+                    ).fetchone()
+                    segment, done = row or ("", 0)
+                    if not added:
+                        self._prune(connection)
+                    count, segment, done = self._index_batch(connection, segment, done)
+                    if count:
+                        connection.execute("DELETE FROM progress")
+                        connection.execute(
+                            "INSERT INTO progress VALUES (?, ?)", (segment, done)
+                        )
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    self._directory_ids.clear()  # May hold rolled back ids
+                    raise
+            if not count:
+                return added
+            added += count
+
+    def _prune(self, connection):
+        # Drops the events of segments the journal no longer has. Ids are never
+        # reused (AUTOINCREMENT), so a segment's events all follow its first_id.
+        segments = self.reader.segments()
+        if not segments:
+            return
+        oldest = os.path.basename(segments[0])
+        connection.execute(
+            "DELETE FROM events WHERE id < coalesce("
+            "(SELECT min(first_id) FROM segments WHERE name >= ?),"
+            " (SELECT max(id) + 1 FROM events))",
+            (oldest,),
+        )
+        connection.execute("DELETE FROM segments WHERE name < ?", (oldest,))
+
+    def _directory_id(self, connection, path):
+        directory_id = self._directory_ids.get(path)
+        if directory_id is None:
+            connection.execute(
+                "INSERT OR IGNORE INTO directories (path) VALUES (?)", (path,)
+            )
+            (directory_id,) = connection.execute(
+                "SELECT id FROM directories WHERE path = ?", (path,)
+            ).fetchone()
+            self._directory_ids[path] = directory_id
+        return directory_id
+
+    def _index_batch(self, connection, segment, done):
+        # Inserts up to BATCH_SIZE events after record `done` of `segment`.
+        # Returns their count and the position after them.
+        rows = []
+        for path in self.reader.segments():
+            name = os.path.basename(path)
+            if name < segment:
+                continue
+            start = done if name == segment else 0
+            if name != segment or not done:
+                self._insert(connection, rows)
+                rows = []
+                connection.execute(
+                    "INSERT OR IGNORE INTO segments VALUES (?, coalesce("
+                    "(SELECT seq FROM sqlite_sequence WHERE name = 'events'), 0) + 1)",
+                    (name,),
+                )
+            segment, done = name, start
+            for record in self.reader.raw_records(path, start):
+                rows.append(self._row(connection, record, path))
+                done += 1
+                if len(rows) >= BATCH_SIZE:
+                    self._insert(connection, rows)
+                    return len(rows), segment, done
+        self._insert(connection, rows)
+        return len(rows), segment, done
+
+    def _row(self, connection, record, segment):
+        timestamp, watcher, dir_id, name_id, dest_dir, dest_name, kind, _ = record
+        newest = max(watcher, dir_id, name_id)
+        if dest_dir != NO_STRING:
+            newest = max(newest, dest_dir, dest_name)
+        strings = self.reader.strings(segment, newest + 1)
+        dest_directory = dest = None
+        if dest_dir != NO_STRING:
+            dest_directory = self._directory_id(connection, strings[dest_dir])
+            dest = strings[dest_name]
+        return (
+            int(timestamp // BUCKET_SECONDS),
+            timestamp,
+            kind,
+            self._directory_id(connection, strings[watcher]),
+            self._directory_id(connection, strings[dir_id]),
+            strings[name_id],
+            dest_directory,
+            dest,
+        )
+
+    def _insert(self, connection, rows):
+        if rows:
+            connection.executemany(
+                "INSERT INTO events (bucket, timestamp, kind, watcher, directory,"
+                " name, dest_directory, dest_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def search(self, under=None, since=None, until=None, limit=PAGE_SIZE, after=None):
+        # Newest first. Returns (entries, cursor); pass the cursor back as
+        # `after` for the next page, it is None after the last one.
+        clauses = []
+        params = []
+        if under:
+            under = os.path.normpath(under)
+            # Events in the folder and moves into it
+            clauses.append(
+                f"(directory IN ({SUBTREE}) OR dest_directory IN ({SUBTREE}))"
+            )
+            subtree = [under, under + chr(ord(os.sep) + 1), under]
+            subtree += [len(under) + 1, os.sep]
+            params += subtree * 2
+        if since is not None:
+            clauses.append("bucket >= ? AND timestamp >= ?")
+            params += [int(since // BUCKET_SECONDS), since]
+        if until is not None:
+            clauses.append("bucket <= ? AND timestamp < ?")
+            params += [int(until // BUCKET_SECONDS), until]
+        if after is not None:
+            clauses.append("(timestamp, events.id) < (?, ?)")
+            params += list(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.connection().execute(
+            "SELECT events.id, timestamp, kind, watchers.path, directories.path,"
+            " name, destinations.path, dest_name FROM events"
+            " JOIN directories AS watchers ON watchers.id = watcher"
+            " JOIN directories ON directories.id = directory"
+            " LEFT JOIN directories AS destinations"
+            " ON destinations.id = dest_directory"
+            f" {where} ORDER BY timestamp DESC, events.id DESC LIMIT ?",
+            params + [limit],
+        ).fetchall()
+        entries = []
+        for _, timestamp, kind, watcher, directory, name, dest_dir, dest in rows:
+            dest_path = None if dest_dir is None else os.path.join(dest_dir, dest)
+            path = os.path.join(directory, name)
+            entries.append(JournalEntry(timestamp, kind, watcher, path, dest_path))
+        cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return entries, cursor
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local.connection = None
+
+
+class Indexer(Thread):
+    # Runs catch_up() for the journal thread, which only calls notify() after
+    # each write and so never waits on SQLite. Notifications that arrive while
+    # indexing collapse into one more pass; stop() runs a final one.
+    def __init__(self, history):
+        super().__init__(name="filewatcher-history", daemon=True)
+        self.history = history
+        self._condition = Condition()
+        self._pending = False
+        self._stopping = False
+
+    def notify(self):
+        with self._condition:
+            self._pending = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                self._pending = False
+                stopping = self._stopping
+            try:
+                self.history.catch_up()
+            except sqlite3.Error as e:
+                print(f"Error indexing journal: {e}")
+            if stopping:
+                return
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.join()
+
+
+def parse_time(text):
+    # Accepts "14:00" (today), an ISO date/time or a Unix timestamp
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        clock = datetime.strptime(text, "%H:%M").time()
+        return datetime.combine(datetime.now().date(), clock).timestamp()
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def format_entry(entry):
+    when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.timestamp))
+    line = f"{when}  {entry.kind_name:<8}  {entry.path}"
+    if entry.dest_path:
+        line += f" -> {entry.dest_path}"
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="filewatcher.history")
+    parser.add_argument("journal", help="journal directory (the daemon's --journal)")
+    parser.add_argument("--under", help="only events below this folder")
+    parser.add_argument("--since", type=parse_time, help="14:00, ISO time or epoch")
+    parser.add_argument("--until", type=parse_time)
+    parser.add_argument("--limit", type=int, default=PAGE_SIZE)
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.journal):
+        parser.error(f"no journal in {args.journal}")
+    index = HistoryIndex(args.journal)
+    index.catch_up()
+    under = os.path.abspath(os.path.expanduser(args.under)) if args.under else None
+    entries, _ = index.search(under, args.since, args.until, args.limit)
+    for entry in entries:
+        print(format_entry(entry))
+    index.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,498 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+from threading import Lock, Thread
+
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MOVED,
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirModifiedEvent,
+    DirMovedEvent,
+    FileClosedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+# Linux-only observer that puts every watched folder on one inotify fd and
+# reads it from one thread through epoll. It can replace watchdog's Observer,
+# which starts an inotify instance and emitter thread per scheduled watch.
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+)
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+READ_BUFFER_SIZE = 256 * 1024  # Large reads drain a whole burst per syscall
+MOVE_PAIR_TIMEOUT = 0.5  # Seconds to wait for the IN_MOVED_TO of a move
+
+
+class FileAttribEvent(FileModifiedEvent):
+    # IN_ATTRIB (touch, chmod): a modification to handlers that do not look,
+    # but not a write to the file's content
+    is_attrib = True
+
+
+def is_supported():
+    return hasattr(select, "epoll") and ctypes.util.find_library("c") is not None
+
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+
+def count_directories(root):
+    count = 0
+    stack = [root]
+    while stack:
+        count += 1
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+    return count
+
+
+class InotifyWatch:
+    # Returned by InotifyObserver.schedule(), like watchdog's ObservedWatch.
+    # prune(directory) keeps excluded subtrees out of a recursive watch;
+    # pruned holds the roots of the skipped subtrees.
+    def __init__(self, handler, path, recursive, prune=None):
+        self.handler = handler
+        self.path = path
+        self.is_recursive = recursive
+        self.prune = prune
+        self.wds = set()
+        self.pruned = set()
+
+    @property
+    def watch_count(self):
+        return len(self.wds)
+
+    @property
+    def saved_watch_count(self):
+        # Walks the pruned subtrees on the caller's thread rather than the
+        # observer's, every time: excluded trees like node_modules keep
+        # growing, so an earlier count goes stale
+        return sum(count_directories(path) for path in list(self.pruned))
+
+    def is_pruned(self, directory):
+        if self.prune is None or directory == self.path:
+            return False
+        return self.prune(directory)
+
+
+class InotifyObserver(Thread):
+    def __init__(self):
+        super().__init__(name="filewatcher-inotify", daemon=True)
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wake_r, self._wake_w = os.pipe()
+        self._epoll = select.epoll()
+        self._epoll.register(self._fd, select.EPOLLIN)
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+
+        self._lock = Lock()
+        self._paths = {}  # wd -> directory path
+        self._wd_watches = {}  # wd -> set of InotifyWatch
+        self._watches = set()
+        self._pending_moves = {}  # cookie -> (wd, path, is_directory, time)
+        self._running = True
+
+        # IN_Q_OVERFLOW: the kernel queue was full and events were dropped.
+        # overflow_callback(watches, since) gets the watches that had events
+        # in the overflowing burst and the time of the read before it.
+        self.overflow_callback = None
+        self.overflows = 0
+        self._overflowed = False
+        self._read_at = time.time()
+
+    @property
+    def watch_count(self):
+        return len(self._paths)
+
+    def schedule(self, event_handler, path, recursive=False, prune=None):
+        watch = InotifyWatch(event_handler, os.path.abspath(path), recursive, prune)
+        with self._lock:
+            self._watches.add(watch)
+            if recursive:
+                self._add_tree(watch, watch.path)
+            else:
+                self._add_dir(watch, watch.path)
+        return watch
+
+    def unschedule(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+            for wd in list(watch.wds):
+                self._detach(watch, wd)
+
+    def update_prune(self, watch, prune):
+        # Exclusions changed: drop watches that are now excluded and pick up
+        # folders that are no longer excluded
+        with self._lock:
+            watch.prune = prune
+            for directory in sorted(self._paths[wd] for wd in watch.wds):
+                if watch.is_pruned(directory):
+                    self._drop_tree(directory, watch)
+            watch.pruned.clear()
+            if watch.is_recursive:
+                self._add_tree(watch, watch.path)
+
+    def rewatch(self, watch, events):
+        # A rescan found folder changes whose events were lost with a queue
+        # overflow: watch the folders that appeared and forget the ones that
+        # are gone. events are the rescan's synthetic events, parents first.
+        added = set()
+        with self._lock:
+            for event in events:
+                if not event.is_directory:
+                    continue
+                if event.event_type == EVENT_TYPE_DELETED:
+                    self._drop_tree(event.src_path, watch)
+                    watch.pruned.discard(event.src_path)
+                    continue
+                if event.event_type == EVENT_TYPE_MOVED:
+                    # The kernel watches moved with the folder's inode
+                    self._rename_tree(event.src_path, event.dest_path)
+                    self._moved_directory(watch, event.src_path, event.dest_path)
+                    path = event.dest_path
+                elif event.event_type == EVENT_TYPE_CREATED:
+                    path = event.src_path
+                else:
+                    continue
+                if os.path.dirname(path) in added:
+                    added.add(path)  # Watched with its parent's tree
+                elif watch.is_recursive:
+                    self._add_tree(watch, path)  # Or marks it pruned
+                    added.add(path)
+
+    def refresh(self, watches):
+        # After an overflow without a rescan: watch the folders whose
+        # IN_CREATE or IN_MOVED_TO was lost and forget those that are gone.
+        # The trees are walked without the lock, only the changes take it.
+        for watch in watches:
+            if not watch.is_recursive:
+                continue
+            with self._lock:
+                known = {self._paths[wd]: wd for wd in watch.wds}
+            missing = []
+            stack = [watch.path]
+            while stack:
+                path = stack.pop()
+                if watch.is_pruned(path):
+                    continue
+                if known.pop(path, None) is None:
+                    missing.append(path)  # _add_tree() takes its subtree
+                    continue
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                except OSError:
+                    continue
+            with self._lock:
+                for wd in known.values():  # Not found in the tree any more
+                    self._detach(watch, wd)
+                for path in missing:
+                    self._add_tree(watch, path)
+
+    def unschedule_all(self):
+        for watch in list(self._watches):
+            self.unschedule(watch)
+
+    def stop(self):
+        self._running = False
+        os.write(self._wake_w, b"x")
+
+    def run(self):
+        try:
+            while self._running:
+                # Only use a timeout while a move is waiting for its pair
+                timeout = MOVE_PAIR_TIMEOUT if self._pending_moves else -1
+                ready = self._epoll.poll(timeout)
+                if not self._running:
+                    break
+                for fd, _ in ready:
+                    if fd == self._fd:
+                        self._read_events()
+                if self._pending_moves:
+                    self._dispatch(self._flush_pending_moves())
+        finally:
+            self._epoll.close()
+            os.close(self._fd)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def _read_events(self):
+        since, self._read_at = self._read_at, time.time()
+        chunks = []
+        while True:
+            try:
+                chunks.append(os.read(self._fd, READ_BUFFER_SIZE))
+            except BlockingIOError:
+                break
+        events = []
+        with self._lock:
+            for chunk in chunks:
+                self._parse(chunk, events)
+            overflowed, self._overflowed = self._overflowed, False
+        self._dispatch(events)
+        if overflowed:
+            self._report_overflow(events, since)
+
+    def _report_overflow(self, events, since):
+        # The queue belongs to the whole fd, so the lost events can not be
+        # attributed exactly; the watches that filled the queue are the ones
+        # that were busy. Everything is suspect if none of them is known.
+        self.overflows += 1
+        affected = set()
+        for watches, _ in events:
+            affected.update(watches)
+        if not affected:
+            with self._lock:
+                affected = set(self._watches)
+        if self.overflow_callback is None:
+            print("inotify event queue overflowed, events were lost")
+            return
+        try:
+            self.overflow_callback(affected, since)
+        except Exception as e:
+            print(f"Error handling event queue overflow: {e}")
+
+    def _parse(self, buffer, events):
+        view = memoryview(buffer)
+        offset = 0
+        end = len(buffer)
+        while offset < end:
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(view, offset)
+            offset += EVENT_HEADER.size
+            name = bytes(view[offset : offset + length]).rstrip(b"\0")
+            offset += length
+            self._translate(wd, mask, cookie, os.fsdecode(name), events)
+
+    def _translate(self, wd, mask, cookie, name, events):
+        if mask & IN_Q_OVERFLOW:
+            self._overflowed = True  # Comes with wd -1
+            return
+        if mask & IN_IGNORED:
+            self._forget(wd)
+            return
+        directory = self._paths.get(wd)
+        if directory is None:
+            return
+        path = os.path.join(directory, name) if name else directory
+        is_directory = bool(mask & IN_ISDIR)
+        watches = self._wd_watches.get(wd, ())
+
+        if mask & IN_MOVED_FROM:
+            self._pending_moves[cookie] = (wd, path, is_directory, time.monotonic())
+        elif mask & IN_MOVED_TO:
+            source = self._pending_moves.pop(cookie, None)
+            if source is not None:
+                src_wd, src_path, _, _ = source
+                targets = watches or self._wd_watches.get(src_wd, ())
+                if is_directory:
+                    self._rename_tree(src_path, path)
+                    for watch in tuple(targets):
+                        self._moved_directory(watch, src_path, path)
+                event_class = DirMovedEvent if is_directory else FileMovedEvent
+                events.append((targets, event_class(src_path, path)))
+            else:
+                self._created(watches, path, is_directory, events)
+        elif mask & IN_CREATE:
+            self._created(watches, path, is_directory, events)
+        elif mask & IN_DELETE:
+            if is_directory:
+                for watch in watches:
+                    watch.pruned.discard(path)
+            event_class = DirDeletedEvent if is_directory else FileDeletedEvent
+            events.append((watches, event_class(path)))
+        elif mask & IN_CLOSE_WRITE:
+            events.append((watches, FileClosedEvent(path)))
+        elif is_directory:
+            if mask & (IN_MODIFY | IN_ATTRIB):
+                events.append((watches, DirModifiedEvent(path)))
+        elif mask & IN_MODIFY:
+            events.append((watches, FileModifiedEvent(path)))
+        elif mask & IN_ATTRIB:
+            events.append((watches, FileAttribEvent(path)))
+
+    def _created(self, watches, path, is_directory, events):
+        if not is_directory:
+            events.append((watches, FileCreatedEvent(path)))
+            return
+        events.append((watches, DirCreatedEvent(path)))
+        for watch in tuple(watches):
+            if watch.is_recursive:
+                self._add_tree(watch, path, events)
+
+    def _moved_directory(self, watch, src_path, dest_path):
+        # A folder renamed into or out of an excluded name gains or loses
+        # its watches
+        if not watch.is_recursive:
+            return
+        prefix = src_path + os.sep
+        for pruned_path in [p for p in watch.pruned if p.startswith(prefix)]:
+            watch.pruned.remove(pruned_path)
+            watch.pruned.add(dest_path + pruned_path[len(src_path) :])
+        was_pruned = src_path in watch.pruned
+        watch.pruned.discard(src_path)
+        if watch.is_pruned(dest_path):
+            if not was_pruned:
+                self._drop_tree(dest_path, watch)
+            watch.pruned.add(dest_path)
+        elif was_pruned:
+            self._add_tree(watch, dest_path)
+
+    def _flush_pending_moves(self):
+        # A move without a matching IN_MOVED_TO in time left the watched tree
+        events = []
+        deadline = time.monotonic() - MOVE_PAIR_TIMEOUT
+        with self._lock:
+            for cookie, move in list(self._pending_moves.items()):
+                wd, path, is_directory, moved_at = move
+                if moved_at > deadline:
+                    continue
+                del self._pending_moves[cookie]
+                event_class = DirDeletedEvent if is_directory else FileDeletedEvent
+                events.append((self._wd_watches.get(wd, ()), event_class(path)))
+                if is_directory:
+                    self._drop_tree(path)
+        return events
+
+    def _dispatch(self, events):
+        for watches, event in events:
+            for watch in tuple(watches):
+                try:
+                    watch.handler.dispatch(event)
+                except Exception as e:
+                    print(f"Error handling {event.src_path}: {e}")
+
+    def _add_dir(self, watch, path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                print("inotify watch limit reached, raise fs.inotify.max_user_watches")
+            elif err not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                print(f"Error watching {path}: {os.strerror(err)}")
+            return None
+        self._paths[wd] = path
+        self._wd_watches.setdefault(wd, set()).add(watch)
+        watch.wds.add(wd)
+        return wd
+
+    def _add_tree(self, watch, root, events=None):
+        # Watch every directory below root. When a directory appears while we
+        # are running, report what was created in it before the watch existed.
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if watch.is_pruned(path):
+                watch.pruned.add(path)
+                continue
+            if self._add_dir(watch, path) is None:
+                continue
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        is_directory = entry.is_dir(follow_symlinks=False)
+                        if is_directory:
+                            stack.append(entry.path)
+                        if events is None:
+                            continue
+                        # Its own events came before the watch existed
+                        event_class = (
+                            DirCreatedEvent if is_directory else FileCreatedEvent
+                        )
+                        event = event_class(entry.path, is_synthetic=True)
+                        events.append(({watch}, event))
+            except OSError:
+                continue
+
+    def _rename_tree(self, src_path, dest_path):
+        prefix = src_path + os.sep
+        for wd, path in self._paths.items():
+            if path == src_path:
+                self._paths[wd] = dest_path
+            elif path.startswith(prefix):
+                self._paths[wd] = dest_path + path[len(src_path) :]
+
+    def _drop_tree(self, root, watch=None):
+        # Stop watching everything below root, for one watch or for all
+        prefix = root + os.sep
+        for wd, path in list(self._paths.items()):
+            if path == root or path.startswith(prefix):
+                if watch is not None:
+                    self._detach(watch, wd)
+                else:
+                    self._libc.inotify_rm_watch(self._fd, wd)
+                    self._forget(wd)
+
+    def _detach(self, watch, wd):
+        watches = self._wd_watches.get(wd)
+        if watches is None:
+            return
+        watches.discard(watch)
+        watch.wds.discard(wd)
+        if not watches:
+            self._libc.inotify_rm_watch(self._fd, wd)
+            self._forget(wd)
+
+    def _forget(self, wd):
+        self._paths.pop(wd, None)
+        for watch in self._wd_watches.pop(wd, ()):
+            watch.wds.discard(wd)
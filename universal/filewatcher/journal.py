@@ -0,0 +1,416 @@
+import mmap
+import os
+import struct
+import time
+from threading import Condition, Lock, Thread
+from typing import NamedTuple
+
+from .records import EVENT_NAMES, split_path
+
+# Append-only event journal. A journal directory holds:
+#
+#   events-NNNNNN.log  segments: a 16 byte header and fixed 32 byte records
+#   strings-NNNNNN.dat the segment's interned strings: uint32 length + UTF-8
+#                      bytes each, the n-th string has id n
+#
+# A record is (timestamp, watcher id, directory id, name id, destination
+# directory id, destination name id, event code, flags). Ids index the string
+# table of the record's segment; NO_STRING marks a missing destination.
+# Records are buffered and written by a background thread in groups, strings
+# always before the records that use them, so a crash loses at most the last
+# commit interval. Every segment starts a new string table, so the writer's
+# table only grows with one segment and old segments can be deleted whole.
+# A new run appends to the last segment while it has room, after cutting off
+# a torn record or string at its end. Version 1 journals kept one
+# strings.dat for all segments.
+MAGIC = b"FWJ1"
+VERSION = 2
+HEADER = struct.Struct("<4sHH8x")
+RECORD = struct.Struct("<dIIIIIBB2x")
+STRING_LENGTH = struct.Struct("<I")
+NO_STRING = 0xFFFFFFFF
+IS_DIRECTORY = 0x01  # Record flag
+
+STRINGS_FILE = "strings.dat"  # Version 1 only
+SEGMENT_PATTERN = "events-{:06d}.log"
+SEGMENT_SIZE = 64 * 1024 * 1024  # About two million records per segment
+RETAIN_BYTES = 1024**3  # Oldest segments are deleted beyond this total
+COMMIT_INTERVAL = 0.2  # Longest time a record waits for its commit
+MAX_BUFFERED = 65536  # Records that force a commit before the interval
+CACHED_STRING_TABLES = 2  # Per JournalReader
+
+EVENT_CODES = {name: code for code, name in enumerate(EVENT_NAMES)}
+
+
+class JournalEntry(NamedTuple):
+    timestamp: float
+    kind: int
+    watcher: str
+    path: str
+    dest_path: str = None
+    is_directory: bool = False
+
+    @property
+    def kind_name(self):
+        return EVENT_NAMES[self.kind]
+
+
+def segment_paths(directory):
+    names = sorted(
+        name
+        for name in os.listdir(directory)
+        if name.startswith("events-") and name.endswith(".log")
+    )
+    return [os.path.join(directory, name) for name in names]
+
+
+def segment_strings_path(segment):
+    directory, name = os.path.split(segment)
+    return os.path.join(directory, "strings-" + name[len("events-") : -4] + ".dat")
+
+
+def strings_path(segment):
+    # The string table of a segment, or the shared one of a version 1 journal
+    path = segment_strings_path(segment)
+    if os.path.exists(path):
+        return path
+    return os.path.join(os.path.dirname(segment), STRINGS_FILE)
+
+
+def load_strings(path, start=0):
+    # Returns (strings, valid length) of the table from byte start on; a
+    # torn string at the end is left out
+    try:
+        with open(path, "rb") as file:
+            file.seek(start)
+            data = file.read()
+    except FileNotFoundError:
+        return [], start
+    strings = []
+    offset = 0
+    while offset + STRING_LENGTH.size <= len(data):
+        (length,) = STRING_LENGTH.unpack_from(data, offset)
+        end = offset + STRING_LENGTH.size + length
+        if end > len(data):
+            break
+        encoded = data[offset + STRING_LENGTH.size : end]
+        strings.append(encoded.decode("utf-8", "surrogateescape"))
+        offset = end
+    return strings, start + offset
+
+
+class Journal(Thread):
+    # Writer side. append() only adds a record tuple to the in-memory buffer,
+    # the thread interns its strings, packs it and does all file I/O.
+    def __init__(
+        self,
+        directory,
+        segment_size=SEGMENT_SIZE,
+        commit_interval=COMMIT_INTERVAL,
+        sync=False,
+        retain_bytes=RETAIN_BYTES,
+    ):
+        super().__init__(name="filewatcher-journal", daemon=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.commit_interval = commit_interval
+        self.sync = sync  # fsync every commit
+        self.retain_bytes = retain_bytes  # None keeps every segment
+        os.makedirs(directory, exist_ok=True)
+
+        segments = segment_paths(directory)
+        self._segment_number = len(segments) and int(segments[-1][-10:-4])
+        self._segment = None
+        self._segment_bytes = 0
+        self._strings_file = None
+        self._ids = {}  # Strings of the current segment, writer thread only
+
+        self._lock = Lock()
+        self._commit = Condition(self._lock)
+        self._records = []
+        self._stopping = False
+        self.listeners = []  # Called on the writer thread after each commit
+        self.appended = 0
+        self.committed = 0
+        self.commits = 0
+
+    def append(
+        self, watcher, kind, path, dest_path=None, timestamp=None, is_directory=False
+    ):
+        if timestamp is None:
+            timestamp = time.time()
+        directory, name = split_path(path)
+        dest = (None, None) if dest_path is None else split_path(dest_path)
+        record = (timestamp, watcher, directory, name, *dest, kind, is_directory)
+        with self._lock:
+            self._records.append(record)
+            self.appended += 1
+            buffered = len(self._records)
+            # The first record arms the commit deadline, a full buffer commits
+            if buffered == 1 or buffered >= MAX_BUFFERED:
+                self._commit.notify()
+
+    def append_event(self, watcher, event):
+        # Journals a watchdog event; opened and unmodified closes are skipped
+        kind = EVENT_CODES.get(event.event_type)
+        if kind is not None:
+            self.append(
+                watcher,
+                kind,
+                event.src_path,
+                event.dest_path or None,
+                is_directory=event.is_directory,
+            )
+
+    def run(self):
+        while True:
+            with self._lock:
+                # Sleeps without a timeout while nothing is buffered, so an
+                # idle journal does not wake up
+                while not self._stopping and not self._records:
+                    self._commit.wait()
+                if not self._stopping and len(self._records) < MAX_BUFFERED:
+                    self._commit.wait(self.commit_interval)
+                records, self._records = self._records, []
+                stopping = self._stopping
+            if records:
+                try:
+                    self._write(records)
+                except OSError as e:
+                    print(f"Error writing journal: {e}")
+                for listener in self.listeners:
+                    try:
+                        listener()
+                    except Exception as e:
+                        print(f"Error after journal commit: {e}")
+            if stopping:
+                break
+        if self._segment is not None:
+            self._segment.close()
+            self._strings_file.close()
+
+    def _write(self, records):
+        strings = []
+        packed = []
+        ids = self._ids
+        for timestamp, watcher, directory, name, *dest, kind, is_dir in records:
+            if self._segment is None and self._reopen_segment():
+                ids = self._ids
+            if self._segment is None or self._segment_bytes >= self.segment_size:
+                self._write_chunk(strings, packed)
+                strings, packed = [], []
+                self._open_segment()
+                ids = self._ids
+            record_ids = []
+            for string in (watcher, directory, name, *dest):
+                if string is None:
+                    record_ids.append(NO_STRING)
+                    continue
+                string_id = ids.get(string)
+                if string_id is None:
+                    string_id = ids[string] = len(ids)
+                    strings.append(string)
+                record_ids.append(string_id)
+            flags = IS_DIRECTORY if is_dir else 0
+            packed.append(RECORD.pack(timestamp, *record_ids, kind, flags))
+            self._segment_bytes += RECORD.size
+        self._write_chunk(strings, packed)
+        self.committed += len(records)
+        self.commits += 1
+
+    def _write_chunk(self, strings, packed):
+        # New strings of the current segment, then the records using them
+        if strings:
+            chunks = []
+            for string in strings:
+                encoded = string.encode("utf-8", "surrogateescape")
+                chunks.append(STRING_LENGTH.pack(len(encoded)))
+                chunks.append(encoded)
+            self._strings_file.write(b"".join(chunks))
+            self._strings_file.flush()
+            if self.sync:
+                os.fsync(self._strings_file.fileno())
+        if packed:
+            self._segment.write(b"".join(packed))
+            self._segment.flush()
+            if self.sync:
+                os.fsync(self._segment.fileno())
+
+    def _reopen_segment(self):
+        # Appends to the last segment of an earlier run while it has room, so
+        # frequent restarts neither leave a trail of tiny segments nor push
+        # history out of retention. Returns False to start a new one.
+        if not self._segment_number:
+            return False
+        path = os.path.join(
+            self.directory, SEGMENT_PATTERN.format(self._segment_number)
+        )
+        strings_file = segment_strings_path(path)
+        try:
+            size = os.path.getsize(path)
+            with open(path, "rb") as file:
+                header = file.read(HEADER.size)
+        except OSError:
+            return False
+        if (
+            size >= self.segment_size
+            or len(header) < HEADER.size
+            or HEADER.unpack(header)[:3] != (MAGIC, VERSION, RECORD.size)
+            or not os.path.exists(strings_file)  # Version 1
+        ):
+            return False
+        strings, valid = load_strings(strings_file)
+        records_end = size - (size - HEADER.size) % RECORD.size
+        os.truncate(strings_file, valid)
+        os.truncate(path, records_end)
+        self._strings_file = open(strings_file, "ab")
+        self._segment = open(path, "ab")
+        self._segment_bytes = records_end
+        self._ids = {string: string_id for string_id, string in enumerate(strings)}
+        self._delete_old_segments()
+        return True
+
+    def _open_segment(self):
+        if self._segment is not None:
+            self._segment.close()
+            self._strings_file.close()
+        self._segment_number += 1
+        path = os.path.join(
+            self.directory, SEGMENT_PATTERN.format(self._segment_number)
+        )
+        self._strings_file = open(segment_strings_path(path), "xb")
+        self._segment = open(path, "xb")
+        self._segment.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._segment_bytes = HEADER.size
+        self._ids = {}
+        self._delete_old_segments()
+
+    def _delete_old_segments(self):
+        # Oldest first, until the journal fits in retain_bytes; the current
+        # segment is always kept
+        if self.retain_bytes is None:
+            return
+        sizes = []
+        for segment in segment_paths(self.directory):
+            paths = [segment, strings_path(segment)]
+            if os.path.basename(paths[1]) == STRINGS_FILE:
+                paths.pop()  # Shared by every version 1 segment
+            size = 0
+            for path in paths:
+                try:
+                    size += os.path.getsize(path)
+                except FileNotFoundError:
+                    pass
+            sizes.append((paths, size))
+        total = sum(size for _, size in sizes)
+        for paths, size in sizes[:-1]:
+            if total <= self.retain_bytes:
+                break
+            for path in paths:  # A reader never sees a segment without strings
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+
+    def flush(self):
+        # Ask for a commit now instead of at the end of the interval
+        with self._lock:
+            self._commit.notify()
+
+    def close(self):
+        with self._lock:
+            self._stopping = True
+            self._commit.notify()
+        if self.is_alive():
+            self.join()
+
+    def stats(self):
+        return {
+            "appended": self.appended,
+            "committed": self.committed,
+            "commits": self.commits,
+            "strings": len(self._ids),
+            "segment": self._segment_number,
+        }
+
+
+class JournalReader:
+    # Scans the segments through mmap without copying them. Safe to use while
+    # a Journal is writing, it sees everything committed so far. String
+    # tables are cached for the last few segments read, and only the strings
+    # appended since are read when a record needs them.
+    def __init__(self, directory):
+        self.directory = directory
+        self._tables = {}  # strings file -> (strings, bytes read)
+
+    def strings(self, segment, needed=0):
+        # The string table of segment, with at least `needed` strings if the
+        # writer committed them
+        path = strings_path(segment)
+        table = self._tables.get(path)
+        if table is None:
+            while len(self._tables) >= CACHED_STRING_TABLES:
+                del self._tables[next(iter(self._tables))]
+            table = self._tables[path] = ([], 0)
+        strings, offset = table
+        if len(strings) < needed:
+            more, offset = load_strings(path, offset)
+            strings.extend(more)
+            self._tables[path] = (strings, offset)
+        return strings
+
+    def segments(self):
+        return segment_paths(self.directory)
+
+    def raw_records(self, segment, start=0):
+        # Yields the unpacked record tuples of one segment, from record start
+        try:
+            file = open(segment, "rb")
+        except FileNotFoundError:
+            return  # Deleted by the writer's retention
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            count = (size - HEADER.size) // RECORD.size
+            if count <= start:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, version, record_size = HEADER.unpack_from(mapped)
+                if magic != MAGIC or record_size != RECORD.size:
+                    raise ValueError(f"Not a journal segment: {segment}")
+                end = HEADER.size + count * RECORD.size
+                view = memoryview(mapped)[HEADER.size + start * RECORD.size : end]
+                try:
+                    yield from RECORD.iter_unpack(view)
+                finally:
+                    view.release()
+
+    def resolve(self, record, segment):
+        # Turns a raw record tuple of `segment` into a JournalEntry
+        timestamp, watcher, dir_id, name_id, dest_dir, dest_name, kind, flags = record
+        newest = max(watcher, dir_id, name_id)
+        if dest_dir != NO_STRING:
+            newest = max(newest, dest_dir, dest_name)
+        strings = self.strings(segment, newest + 1)
+        dest_path = None
+        if dest_dir != NO_STRING:
+            dest_path = os.path.join(strings[dest_dir], strings[dest_name])
+        return JournalEntry(
+            timestamp,
+            kind,
+            strings[watcher],
+            os.path.join(strings[dir_id], strings[name_id]),
+            dest_path,
+            bool(flags & IS_DIRECTORY),
+        )
+
+    def entries(self, start=None, end=None):
+        # JournalEntry for every record with start <= timestamp < end
+        for segment in self.segments():
+            for record in self.raw_records(segment):
+                timestamp = record[0]
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp >= end:
+                    continue
+                yield self.resolve(record, segment)
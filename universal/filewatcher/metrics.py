@@ -0,0 +1,204 @@
+from threading import Lock, current_thread, local
+
+# Pipeline stages, from the observer thread to the popup
+STAGES = (
+    "dispatch",
+    "should_ignore_event",
+    "should_send_notification",
+    "queue_notification",
+    "process_queued_notifications",
+    "display_notification",
+)
+COUNTERS = (
+    "events_in",
+    "ignored",
+    "debounced",
+    "batched",
+    "delivered",
+    "overflowed",
+    "dropped",
+    "kernel_overflows",
+    "rescans",
+)
+
+# Log-linear buckets like HdrHistogram: every power of two is split into
+# SUB_BUCKETS linear buckets, so any recorded value is within 1/SUB_BUCKETS
+# (about 6%) of its bucket's lower bound, from nanoseconds to hours
+SUB_BITS = 5
+SUB_BUCKETS = 1 << (SUB_BITS - 1)
+
+
+def bucket_index(value):
+    shift = max(0, value.bit_length() - SUB_BITS)
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_value(index):
+    # Lowest value that falls in the bucket
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+class LatencyHistogram:
+    # Nanosecond latencies in fixed-precision buckets. Recording takes no
+    # lock, so a histogram is only recorded into from one thread, see Metrics.
+    def __init__(self):
+        self.counts = [0] * (64 * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, nanoseconds):
+        # bucket_index() inlined, this runs for every event
+        shift = nanoseconds.bit_length() - SUB_BITS
+        if shift > 0:
+            self.counts[shift * SUB_BUCKETS + (nanoseconds >> shift)] += 1
+        else:
+            self.counts[nanoseconds] += 1
+        self.count += 1
+        self.total += nanoseconds
+        if nanoseconds > self.max:
+            self.max = nanoseconds
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return bucket_value(index)
+        return self.max
+
+    def add(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def clear(self):
+        self.counts[:] = [0] * len(self.counts)
+        self.count = self.total = self.max = 0
+
+    def summary(self):
+        # Microseconds, for display
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count / 1000 if self.count else 0.0,
+            "p50_us": self.percentile(0.5) / 1000,
+            "p90_us": self.percentile(0.9) / 1000,
+            "p99_us": self.percentile(0.99) / 1000,
+            "p999_us": self.percentile(0.999) / 1000,
+            "max_us": self.max / 1000,
+        }
+
+
+class MetricsShard:
+    # The counters and histograms of one thread
+    def __init__(self, thread):
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+
+    def add(self, other):
+        for name, value in list(other.counters.items()):
+            self.counters[name] = self.counters.get(name, 0) + value
+        for stage, histogram in list(other.histograms.items()):
+            self.histograms.setdefault(stage, LatencyHistogram()).add(histogram)
+
+    def clear(self):
+        for name in self.counters:
+            self.counters[name] = 0
+        for histogram in self.histograms.values():
+            histogram.clear()
+
+
+class Metrics:
+    # Process-wide counters and per-stage latency histograms. Stages time
+    # themselves with time.perf_counter_ns() and call record(). events_in is
+    # not counted separately, it is the number of timed dispatches.
+    #
+    # Dispatch workers and other threads update metrics at the same time, and
+    # an unlocked += from two threads can lose an increment. So every thread
+    # updates a shard of its own, without a lock, and merged() adds the shards
+    # up. Shards of threads that have exited are folded into one.
+    def __init__(self):
+        self._lock = Lock()
+        self._local = local()
+        self._shards = []
+        self._retired = MetricsShard(None)
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = MetricsShard(current_thread())
+            # Looked up directly by count() and record()
+            self._local.counters = shard.counters
+            self._local.histograms = shard.histograms
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def count(self, name, amount=1):
+        try:
+            counters = self._local.counters
+        except AttributeError:
+            counters = self.shard().counters
+        counters[name] = counters.get(name, 0) + amount
+
+    def histogram(self, stage):
+        # The calling thread's histogram for stage
+        histograms = self.shard().histograms
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = LatencyHistogram()
+        return histogram
+
+    def record(self, stage, nanoseconds):
+        try:
+            histogram = self._local.histograms[stage]
+        except (AttributeError, KeyError):
+            histogram = self.histogram(stage)
+        histogram.record(nanoseconds)
+
+    def merged(self):
+        # A MetricsShard with the sums over all threads
+        total = MetricsShard(None)
+        total.counters = dict.fromkeys(COUNTERS, 0)
+        total.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        with self._lock:
+            live = []
+            for shard in self._shards:
+                if shard.thread.is_alive():
+                    live.append(shard)
+                else:
+                    self._retired.add(shard)
+            self._shards = live
+            for shard in [self._retired, *live]:
+                total.add(shard)
+        return total
+
+    def snapshot(self):
+        total = self.merged()
+        counters = total.counters
+        counters["events_in"] = total.histograms["dispatch"].count
+        return {
+            "counters": counters,
+            "stages": {
+                stage: histogram.summary()
+                for stage, histogram in total.histograms.items()
+            },
+        }
+
+    def reset(self):
+        # In place, so threads keep their shards
+        with self._lock:
+            for shard in [self._retired, *self._shards]:
+                shard.clear()
+
+
+metrics = Metrics()
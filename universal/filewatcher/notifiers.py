@@ -0,0 +1,165 @@
+import json
+import os
+import subprocess
+import sys
+import time
+from queue import Full, Queue
+from threading import Lock, Thread
+
+from .metrics import metrics
+
+# Notification backends. Each one has notify(title, message, file_path) and
+# close(). The helper backend keeps one process alive and sends it a line of
+# JSON per notification, so a burst costs writes instead of fork+exec.
+
+# The folder holding the filewatcher package, for starting the helper
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# A helper that exits sooner than this after starting is failing, and is not
+# restarted until the interval has passed
+RESTART_INTERVAL = 1.0
+QUEUED_NOTIFICATIONS = 100  # Waiting in a QueuedNotifier before it drops
+
+
+class StdoutNotifier:
+    def notify(self, title, message, file_path):
+        print(f"{title} {message.strip()}", flush=True)
+
+    def close(self):
+        pass
+
+
+class PlyerNotifier:
+    def __init__(self):
+        # Imported lazily so the engine starts without plyer installed
+        from plyer import notification
+
+        self.notification = notification
+
+    def notify(self, title, message, file_path):
+        self.notification.notify(
+            title=title, message=message, app_name="Luc's FileWatcher"
+        )
+
+    def close(self):
+        pass
+
+
+def default_helper_command():
+    # The Python helper, with osascript on macOS and its stub sink elsewhere.
+    # The committed mac/v15/NotificationSender binary predates the --stdin
+    # mode of its Swift source; once rebuilt it can be passed as the command:
+    #   HelperNotifier([".../NotificationSender", "--stdin"])
+    sink = "osascript" if sys.platform == "darwin" else "stub"
+    return [sys.executable, "-m", "filewatcher.notify_helper", "--sink", sink]
+
+
+class HelperNotifier:
+    # Talks to a long-lived helper over its stdin, one JSON object per line:
+    #   {"title": ..., "subtitle": ..., "body": ..., "path": ...}
+    # The helper is (re)started on first use and after it exits. notify()
+    # raises OSError when the message could not be handed to a helper.
+    def __init__(self, command=None):
+        self.command = command or default_helper_command()
+        self.process = None
+        self.started = None
+        self.lock = Lock()
+
+    def _ensure_process(self):
+        if self.process is None or self.process.poll() is not None:
+            if self.started and time.monotonic() - self.started < RESTART_INTERVAL:
+                raise OSError(f"Notification helper keeps exiting: {self.command}")
+            env = dict(os.environ)
+            env["PYTHONPATH"] = os.pathsep.join(
+                p for p in (SOURCE_DIR, env.get("PYTHONPATH")) if p
+            )
+            self.process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, env=env, close_fds=True
+            )
+            self.started = time.monotonic()
+        return self.process
+
+    def notify(self, title, message, file_path):
+        line = json.dumps(
+            {"title": title, "subtitle": "", "body": message, "path": file_path}
+        )
+        data = (line + "\n").encode("utf-8")
+        with self.lock:
+            for attempt in range(2):
+                process = self._ensure_process()
+                try:
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                    return
+                except BrokenPipeError:
+                    # The helper died; restart it once and resend
+                    self.process = None
+                    if attempt:
+                        raise
+
+    def close(self):
+        with self.lock:
+            if self.process is not None:
+                try:
+                    self.process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                self.process.wait(timeout=5)
+                self.process = None
+
+
+class QueuedNotifier:
+    # Hands notifications to another notifier on a thread of its own, for
+    # callers like observer threads that must not wait while a helper's pipe
+    # is full. When QUEUED_NOTIFICATIONS are waiting, further ones are
+    # dropped and counted. Failed ones go to fallback(title, message,
+    # file_path) on the sender thread, or are printed.
+    def __init__(self, notifier, fallback=None, maxsize=QUEUED_NOTIFICATIONS):
+        self.notifier = notifier
+        self.fallback = fallback
+        self.queue = Queue(maxsize)
+        self.thread = Thread(target=self._send, name="filewatcher-notify", daemon=True)
+        self.thread.start()
+
+    def notify(self, title, message, file_path):
+        try:
+            self.queue.put_nowait((title, message, file_path))
+        except Full:
+            metrics.count("dropped")
+
+    def _send(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                self.notifier.notify(*item)
+            except Exception as e:
+                self._failed(item, e)
+
+    def _failed(self, item, error):
+        if self.fallback is not None:
+            try:
+                self.fallback(*item)
+                return
+            except Exception as e:
+                error = e
+        print(f"Error displaying notification: {error}", file=sys.stderr)
+
+    def close(self):
+        # Sends what is queued, then closes the wrapped notifier
+        self.queue.put(None)
+        self.thread.join()
+        self.notifier.close()
+
+
+NOTIFIERS = {
+    "stdout": StdoutNotifier,
+    "plyer": PlyerNotifier,
+    "helper": HelperNotifier,
+}
+
+
+def make_notifier(name):
+    if name not in NOTIFIERS:
+        raise ValueError(f"Unknown notifier: {name}")
+    return NOTIFIERS[name]()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Long-lived notification helper started by notifiers.HelperNotifier. It
+# reads one JSON message per line from stdin until stdin is closed:
+#   python -m filewatcher.notify_helper --sink stub
+#
+# Sinks get every message that arrived in one read. Messages that pile up
+# while a desktop notification is being shown are merged into the next one,
+# so a burst shows a few notifications instead of one per message.
+READ_SIZE = 64 * 1024
+MERGED_LINES = 5  # Bodies listed in a merged notification
+
+
+def merge(messages):
+    if len(messages) == 1:
+        return messages[0]
+    bodies = [message["body"].strip() for message in messages[:MERGED_LINES]]
+    if len(messages) > MERGED_LINES:
+        bodies.append(f"+{len(messages) - MERGED_LINES} more")
+    return {"title": f"{len(messages)} notifications", "body": "\n".join(bodies)}
+
+
+def stub_sink(messages):
+    # Local stand-in for a desktop notification, used on Linux servers
+    for message in messages:
+        print(f"[notification] {message['title']} {message['body'].strip()}")
+    sys.stdout.flush()
+
+
+def plyer_sink(messages):
+    from plyer import notification
+
+    message = merge(messages)
+    notification.notify(
+        title=message["title"], message=message["body"], app_name="Luc's FileWatcher"
+    )
+
+
+def run_applescript(script):
+    # In this process through PyObjC when it is installed, else one osascript
+    try:
+        from Foundation import NSAppleScript
+    except ImportError:
+        subprocess.run(["osascript", "-e", script])
+        return
+    applescript = NSAppleScript.alloc().initWithSource_(script)
+    _, error = applescript.executeAndReturnError_(None)
+    if error is not None:
+        raise OSError(f"AppleScript failed: {error}")
+
+
+def osascript_sink(messages):
+    # Used on macOS without NotificationSender
+    message = merge(messages)
+    escaped_message = message["body"].replace("\\", "\\\\").replace('"', '\\"')
+    escaped_title = message["title"].replace("\\", "\\\\").replace('"', '\\"')
+    run_applescript(
+        f'display notification "{escaped_message}" with title "{escaped_title}"'
+    )
+
+
+SINKS = {"stub": stub_sink, "plyer": plyer_sink, "osascript": osascript_sink}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="filewatcher.notify_helper")
+    parser.add_argument("--sink", choices=sorted(SINKS), default="stub")
+    args = parser.parse_args(argv)
+    sink = SINKS[args.sink]
+
+    for messages in read_messages(sys.stdin.fileno()):
+        try:
+            sink(messages)
+        except Exception as e:
+            print(f"Error displaying notification: {e}", file=sys.stderr)
+
+
+def read_messages(fd):
+    # Yields the complete messages of each read from fd until it is closed
+    pending = b""
+    while True:
+        data = os.read(fd, READ_SIZE)
+        if not data:
+            return
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        messages = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                messages.append(json.loads(line))
+            except ValueError as e:
+                print(f"Invalid message: {e}", file=sys.stderr)
+        if messages:
+            yield messages
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import time
+from threading import Lock
+from typing import NamedTuple
+
+# Event type codes
+CREATED = 0
+MODIFIED = 1
+DELETED = 2
+MOVED = 3
+CLOSED = 4
+
+EVENT_NAMES = ("created", "modified", "deleted", "moved", "closed")
+
+
+class DirectoryTable:
+    # Interns directory paths to small integer ids for the life of the
+    # process. Lookups of known directories take no lock.
+    def __init__(self):
+        self._ids = {}
+        self._paths = []
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._paths)
+
+    def intern(self, directory):
+        dir_id = self._ids.get(directory)
+        if dir_id is None:
+            with self._lock:
+                dir_id = self._ids.get(directory)
+                if dir_id is None:
+                    dir_id = len(self._paths)
+                    self._paths.append(directory)
+                    self._ids[directory] = dir_id
+        return dir_id
+
+    def path(self, dir_id):
+        return self._paths[dir_id]
+
+
+directories = DirectoryTable()
+
+
+def split_path(path):
+    # os.path.split() without its normalisation work for the common case of
+    # a file at least two levels deep
+    directory, sep, name = path.rpartition(os.sep)
+    if sep and os.sep in directory:
+        return directory, name
+    return os.path.split(path)
+
+
+class EventRecord(NamedTuple):
+    # One file event: interned directory, basename, type code and time.
+    # Moves also carry the destination.
+    dir_id: int
+    name: str
+    kind: int
+    timestamp: float
+    dest_dir_id: int = -1
+    dest_name: str = ""
+
+    @classmethod
+    def create(cls, path, kind, dest_path=None, timestamp=None):
+        directory, name = split_path(path)
+        if timestamp is None:
+            timestamp = time.time()
+        if dest_path is None:
+            return cls(directories.intern(directory), name, kind, timestamp)
+        dest_directory, dest_name = split_path(dest_path)
+        return cls(
+            directories.intern(directory),
+            name,
+            kind,
+            timestamp,
+            directories.intern(dest_directory),
+            dest_name,
+        )
+
+    @property
+    def key(self):
+        # Identifies the file, for deduplicating a batch
+        return self.dir_id, self.name
+
+    @property
+    def directory(self):
+        return directories.path(self.dir_id)
+
+    @property
+    def path(self):
+        return os.path.join(directories.path(self.dir_id), self.name)
+
+    @property
+    def dest_directory(self):
+        return directories.path(self.dest_dir_id) if self.dest_dir_id >= 0 else None
+
+    @property
+    def dest_path(self):
+        if self.dest_dir_id < 0:
+            return None
+        return os.path.join(directories.path(self.dest_dir_id), self.dest_name)
+
+    @property
+    def kind_name(self):
+        return EVENT_NAMES[self.kind]
@@ -0,0 +1,215 @@
+import argparse
+import json
+import time
+from time import perf_counter_ns
+
+from watchdog.events import (
+    DirCreatedEvent,
+    DirDeletedEvent,
+    DirModifiedEvent,
+    DirMovedEvent,
+    FileClosedEvent,
+    FileCreatedEvent,
+    FileDeletedEvent,
+    FileModifiedEvent,
+    FileMovedEvent,
+)
+
+from .debounce import Debouncer
+from .engine import normalize_config
+from .handlers import WatcherHandler
+from .history import parse_time
+from .journal import JournalReader
+from .records import CLOSED, CREATED, DELETED, MODIFIED, MOVED
+
+# Replays a recorded event stream from the journal through WatcherHandler:
+# ignore rules, debounce, queueing and notification formatting, without any
+# filesystem access. Debouncing runs on the recorded timestamps, so the same
+# journal gives the same notifications at any speed.
+#
+#   python -m filewatcher.replay ~/.LucsNewApp-journal             # flat out
+#   python -m filewatcher.replay ~/.LucsNewApp-journal --speed 1   # real time
+#   python -m filewatcher.replay ~/.LucsNewApp-journal --speed 10  # 10x
+
+EVENT_CLASSES = {
+    (CREATED, False): FileCreatedEvent,
+    (CREATED, True): DirCreatedEvent,
+    (MODIFIED, False): FileModifiedEvent,
+    (MODIFIED, True): DirModifiedEvent,
+    (DELETED, False): FileDeletedEvent,
+    (DELETED, True): DirDeletedEvent,
+    (MOVED, False): FileMovedEvent,
+    (MOVED, True): DirMovedEvent,
+    (CLOSED, False): FileClosedEvent,
+}
+
+STAGES = (
+    "dispatch",
+    "should_ignore_event",
+    "should_send_notification",
+    "queue_notification",
+    "format_notification",
+)
+
+
+def make_event(entry):
+    event_class = EVENT_CLASSES.get((entry.kind, entry.is_directory))
+    if event_class is None:
+        return None
+    if entry.kind == MOVED:
+        return event_class(entry.path, entry.dest_path)
+    return event_class(entry.path)
+
+
+class ReplayClock:
+    # Stands in for time.monotonic in the debouncer: the time of the event
+    # being replayed
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ListQueue(list):
+    # The handler's notification_queue, drained after every event
+    def put(self, item):
+        self.append(item)
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+
+    def wrap(self, stage, function):
+        samples = self.samples[stage]
+
+        def timed(*args):
+            started = perf_counter_ns()
+            try:
+                return function(*args)
+            finally:
+                samples.append(perf_counter_ns() - started)
+
+        return timed
+
+    def summary(self):
+        # {stage: (count, mean, p50, p99, max)} in microseconds
+        result = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            count = len(ordered)
+            result[stage] = (
+                count,
+                sum(ordered) / count / 1000,
+                ordered[count // 2] / 1000,
+                ordered[min(count - 1, int(count * 0.99))] / 1000,
+                ordered[-1] / 1000,
+            )
+        return result
+
+
+class Replayer:
+    def __init__(self, folders=(), timer=None):
+        # folders: v14 watched_folders entries, for each watcher's rules
+        self.folders = {folder["path"]: folder for folder in folders}
+        self.timer = timer or StageTimer()
+        self.clock = ReplayClock()
+        self.queue = ListQueue()
+        self.handlers = {}
+        self.notifications = []
+
+    def handler(self, watcher):
+        handler = self.handlers.get(watcher)
+        if handler is None:
+            folder = self.folders.get(watcher, {})
+            handler = WatcherHandler(
+                folder.get("excluded_subfolders", []),
+                self.queue,
+                folder.get("ignore_patterns", []),
+            )
+            handler.debouncer = Debouncer(
+                handler.notification_delay, clock=self.clock
+            )
+            # Instance attributes shadow the methods, so the handler's own
+            # calls go through the timers
+            for stage in STAGES[1:4]:
+                setattr(handler, stage, self.timer.wrap(stage, getattr(handler, stage)))
+            self.handlers[watcher] = handler
+        return handler
+
+    def run(self, entries, speed=0):
+        # speed 0 replays as fast as possible, 1 in real time, N at N times
+        # real time. Returns (events, elapsed seconds).
+        events = []
+        for entry in entries:
+            event = make_event(entry)
+            if event is not None:
+                events.append((entry.timestamp, self.handler(entry.watcher), event))
+        dispatch = self.timer.wrap("dispatch", WatcherHandler.dispatch)
+        format_notification = self.timer.wrap(
+            "format_notification", WatcherHandler.format_notification
+        )
+
+        started = time.perf_counter()
+        first = events[0][0] if events else 0.0
+        for timestamp, handler, event in events:
+            if speed:
+                delay = (timestamp - first) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.clock.now = timestamp
+            dispatch(handler, event)
+            if self.queue:
+                for record in self.queue:
+                    self.notifications.append(format_notification(record))
+                self.queue.clear()
+        return len(events), time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="filewatcher.replay")
+    parser.add_argument("journal", help="journal directory to replay")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="0 for as fast as possible (default), 1 for real time, N for N times",
+    )
+    parser.add_argument("--config", help="watcher config with the ignore rules")
+    parser.add_argument("--since", type=parse_time)
+    parser.add_argument("--until", type=parse_time)
+    parser.add_argument("--verbose", action="store_true", help="print notifications")
+    args = parser.parse_args(argv)
+
+    folders = []
+    if args.config:
+        with open(args.config, "r") as file:
+            folders = normalize_config(json.load(file))["watched_folders"]
+    replayer = Replayer(folders)
+    entries = JournalReader(args.journal).entries(args.since, args.until)
+    count, elapsed = replayer.run(entries, args.speed)
+
+    if args.verbose:
+        for _, message, _ in replayer.notifications:
+            print(message)
+    rate = count / elapsed if elapsed else 0
+    print(
+        f"replayed {count:,} events in {elapsed:.2f}s ({rate:,.0f} events/s), "
+        f"{len(replayer.notifications):,} notifications"
+    )
+    print(
+        f"{'stage':<26}{'count':>10}{'mean us':>10}{'p50 us':>10}"
+        f"{'p99 us':>10}{'max us':>10}"
+    )
+    for stage, (samples, mean, p50, p99, peak) in replayer.timer.summary().items():
+        print(
+            f"{stage:<26}{samples:>10,}{mean:>10.2f}{p50:>10.2f}"
+            f"{p99:>10.2f}{peak:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+from threading import Condition, Thread
+
+from .metrics import metrics
+from .snapshot import MTIME_GRANULARITY_NS, Snapshot, SnapshotScanner
+
+# Recovers from kernel event queue overflows. Every tracked watcher keeps a
+# Snapshot of its tree, taken here when it is tracked and kept current by the
+# handler's events. When the observer reports that events were lost, the
+# watcher's root is scanned again and the diff is dispatched to its handler
+# as synthetic events, so notifications catch up instead of missing changes.
+# Folders the rescan finds created, moved or deleted also get their kernel
+# watches added or dropped, since those events were lost too. Each watcher
+# has its own SnapshotScanner, so a rescan re-reads only the folders whose
+# listing changed since the previous scan.
+BASELINE = None  # pending value: scan without diffing
+UPDATE = "update"  # pending value: apply queued events, fold if large
+
+
+class Rescanner(Thread):
+    def __init__(self, observer=None):
+        super().__init__(name="filewatcher-rescan", daemon=True)
+        self.observer = observer  # InotifyObserver whose watches to repair
+        self.tracked = {}  # root -> (handler, prune, SnapshotScanner, watch)
+        self.pending = {}  # root -> since_ns, BASELINE or UPDATE
+        self._changed = Condition()
+        self._running = True
+
+    def track(self, root, handler, prune=None, watch=None):
+        # (Re)takes the baseline snapshot in the background. Events from now
+        # on are kept for it, so none is lost while it is taken.
+        if handler.snapshot is None:
+            snapshot = Snapshot(root, on_queued=lambda: self.update(root))
+            snapshot.begin()
+            handler.snapshot = snapshot
+        with self._changed:
+            self.tracked[root] = (handler, prune, SnapshotScanner(), watch)
+            self.pending[root] = BASELINE
+            self._changed.notify()
+
+    def untrack(self, root):
+        with self._changed:
+            handler = self.tracked.pop(root, (None,))[0]
+            self.pending.pop(root, None)
+        if handler is not None:
+            handler.snapshot = None
+
+    def request(self, root, since):
+        # Rescan root for changes from `since` (epoch seconds) on. Returns
+        # False when a rescan of root was already waiting.
+        since_ns = int(since * 1e9) - MTIME_GRANULARITY_NS
+        with self._changed:
+            if root not in self.tracked:
+                return False
+            previous = self.pending.get(root, UPDATE)
+            if previous is BASELINE:
+                return False  # No baseline yet, there is nothing to diff
+            waiting = previous is not UPDATE  # A rescan also updates
+            self.pending[root] = since_ns if not waiting else min(since_ns, previous)
+            self._changed.notify()
+        return not waiting
+
+    def update(self, root):
+        # Called by a Snapshot with many queued events
+        with self._changed:
+            if root in self.tracked and root not in self.pending:
+                self.pending[root] = UPDATE
+                self._changed.notify()
+
+    def stop(self):
+        with self._changed:
+            self._running = False
+            self._changed.notify()
+
+    def run(self):
+        while True:
+            with self._changed:
+                while self._running and not self.pending:
+                    self._changed.wait()
+                if not self._running:
+                    return
+                root, since_ns = self.pending.popitem()
+                handler, prune, scanner, watch = self.tracked[root]
+            snapshot = handler.snapshot
+            if snapshot is None:
+                continue
+            try:
+                if since_ns is not UPDATE:
+                    self._scan(handler, snapshot, prune, scanner, watch, since_ns)
+                elif snapshot.update():
+                    snapshot.fold()
+            except Exception as e:
+                print(f"Error rescanning {root}: {e}")
+
+    def stats(self):
+        # {root: ScanStats of its last scan as a dict}
+        with self._changed:
+            tracked = list(self.tracked.items())
+        return {
+            root: scanner.stats._asdict()
+            for root, (_, _, scanner, _) in tracked
+            if scanner.stats is not None
+        }
+
+    def _scan(self, handler, snapshot, prune, scanner, watch, since_ns):
+        # Events during the scan wait in the snapshot's window. The diff is
+        # against the state when the scan began; paths with events during
+        # the scan were reported by those events and are left out of it.
+        snapshot.begin()
+        current = scanner.scan(snapshot.root, prune, previous=snapshot.base)
+        events = []
+        if since_ns is not BASELINE:
+            metrics.count("rescans")
+            events = snapshot.diff(current, since_ns)
+        touched = snapshot.rebase(current)
+        if events and watch is not None and self.observer is not None:
+            self.observer.rewatch(watch, events)
+        for event in events:
+            if event.src_path in touched or event.dest_path in touched:
+                continue
+            handler.deliver(event)
@@ -0,0 +1,91 @@
+import fnmatch
+import os
+import re
+
+# Built-in rules of the v14 handler: temporary and system files by suffix,
+# hidden and Office lock files by basename prefix
+IGNORED_SUFFIXES = (".DS_Store", "Thumbs.db", ".tmp", "~$", "._")
+IGNORED_PREFIXES = (".", "~")
+
+_EXCLUDED = None  # Marks the end of an excluded path in the trie
+
+
+def _split(path):
+    return os.path.normpath(path).split(os.sep)
+
+
+class IgnoreRules:
+    # All ignore rules of one watcher compiled into a single matcher. Build a
+    # new instance when the config changes; matches() never allocates rules.
+    #
+    # - excluded_paths: folders whose whole subtree is ignored, looked up in a
+    #   trie of path components, so the cost depends on the path depth only
+    # - patterns: user globs; "*.log" matches the file name, a glob with a
+    #   separator such as "build/*" matches the path at any depth
+    def __init__(
+        self,
+        excluded_paths=(),
+        patterns=(),
+        suffixes=IGNORED_SUFFIXES,
+        prefixes=IGNORED_PREFIXES,
+    ):
+        self.excluded_paths = tuple(excluded_paths)
+        self.patterns = tuple(patterns)
+        self.suffixes = tuple(suffixes)
+        self.prefixes = tuple(prefixes)
+
+        self._trie = {}
+        for path in self.excluded_paths:
+            node = self._trie
+            for part in _split(path):
+                node = node.setdefault(part, {})
+            node[_EXCLUDED] = True
+
+        name_globs = [p for p in self.patterns if "/" not in p and os.sep not in p]
+        path_globs = [
+            p if os.path.isabs(p) else "*/" + p
+            for p in self.patterns
+            if "/" in p or os.sep in p
+        ]
+        self._name_re = self._compile(name_globs)
+        self._path_re = self._compile([os.path.normpath(p) for p in path_globs])
+
+    @staticmethod
+    def _compile(globs):
+        if not globs:
+            return None
+        return re.compile("|".join(f"(?:{fnmatch.translate(g)})" for g in globs))
+
+    def is_excluded(self, path):
+        node = self._trie
+        if not node:
+            return False
+        for part in path.split(os.sep):
+            node = node.get(part)
+            if node is None:
+                return False
+            if _EXCLUDED in node:
+                return True
+        return False
+
+    def prunes(self, directory):
+        # Whether a directory can be left out of the watch tree entirely.
+        # Hidden folders are not pruned: only their file names are ignored.
+        if self.is_excluded(directory):
+            return True
+        name = directory[directory.rfind(os.sep) + 1 :]
+        if self._name_re is not None and self._name_re.match(name):
+            return True
+        return self._path_re is not None and self._path_re.match(directory) is not None
+
+    def matches(self, path):
+        if path.endswith(self.suffixes):
+            return True
+        name = path[path.rfind(os.sep) + 1 :]
+        if name.startswith(self.prefixes):
+            return True
+        if self._name_re is not None and self._name_re.match(name):
+            return True
+        if self._path_re is not None and self._path_re.match(path):
+            return True
+        return self.is_excluded(path)
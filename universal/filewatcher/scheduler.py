@@ -0,0 +1,152 @@
+import math
+import time
+from threading import Condition, Thread
+
+# Hierarchical timer wheel: 4 levels of 64 slots with 10 ms ticks cover
+# 0.64 s, 41 s, 44 min and 46 h. Timers further out sit in the last level
+# and are re-filed when they come closer.
+TICK = 0.01
+SLOT_BITS = 6
+SLOTS = 1 << SLOT_BITS
+SLOT_MASK = SLOTS - 1
+LEVELS = 4
+
+
+class Timer:
+    __slots__ = ("due", "callback", "args", "slot")
+
+    def __init__(self, due, callback, args):
+        self.due = due  # Absolute tick
+        self.callback = callback
+        self.args = args
+        self.slot = None  # The slot set holding this timer, for O(1) cancel
+
+
+class TimerWheel:
+    # Insert and cancel are O(1). Not thread-safe on its own, the Scheduler
+    # holds its lock around every call.
+    def __init__(self, now_tick=0):
+        self.now = now_tick
+        self.wheels = [[set() for _ in range(SLOTS)] for _ in range(LEVELS)]
+        self.count = 0
+
+    def insert(self, timer):
+        delta = timer.due - self.now
+        level = 0
+        while level < LEVELS - 1 and delta >= SLOTS << (SLOT_BITS * level):
+            level += 1
+        index = (max(timer.due, self.now + 1) >> (SLOT_BITS * level)) & SLOT_MASK
+        slot = self.wheels[level][index]
+        slot.add(timer)
+        timer.slot = slot
+        self.count += 1
+
+    def remove(self, timer):
+        if timer.slot is not None:
+            timer.slot.discard(timer)
+            timer.slot = None
+            self.count -= 1
+
+    def advance(self, now_tick):
+        # Moves the wheel to now_tick and returns the timers that are due.
+        # Each level walks at most one full turn, whatever the jump size.
+        due = []
+        previous = self.now
+        self.now = now_tick
+        for level in range(LEVELS - 1, -1, -1):
+            shift = SLOT_BITS * level
+            first, last = (previous >> shift) + 1, now_tick >> shift
+            if level == 0:
+                first = previous + 1
+            for index in range(max(first, last - SLOT_MASK), last + 1):
+                slot = self.wheels[level][index & SLOT_MASK]
+                if not slot:
+                    continue
+                timers = list(slot)
+                slot.clear()
+                self.count -= len(timers)
+                for timer in timers:
+                    timer.slot = None
+                    if timer.due <= now_tick:
+                        due.append(timer)
+                    else:
+                        self.insert(timer)
+        due.sort(key=lambda timer: timer.due)
+        return due
+
+    def next_due(self):
+        # Earliest due tick, or None when the wheel is empty
+        if not self.count:
+            return None
+        earliest = None
+        for level in range(LEVELS):
+            shift = SLOT_BITS * level
+            start = self.now >> shift
+            # The current slot was emptied by advance(), anything in it now
+            # wrapped around and is a full turn away, so it is checked last
+            for offset in range(1, SLOTS + 1):
+                slot = self.wheels[level][(start + offset) & SLOT_MASK]
+                if slot:
+                    due = min(timer.due for timer in slot)
+                    if earliest is None or due < earliest:
+                        earliest = due
+                    break
+        return earliest
+
+
+class Scheduler(Thread):
+    # Runs delayed callbacks for every watcher on a single daemon thread. It
+    # replaces Tk's root.after() so the handlers can batch without a display,
+    # and it sleeps until the next timer is due instead of ticking.
+    def __init__(self):
+        super().__init__(name="filewatcher-scheduler", daemon=True)
+        self._start = time.monotonic()
+        self._wheel = TimerWheel()
+        self._cond = Condition()
+        self._running = True
+        self._wake_tick = None  # Tick the thread sleeps until, None for ever
+
+    def _tick(self):
+        return int((time.monotonic() - self._start) / TICK)
+
+    def call_later(self, delay, callback, *args):
+        with self._cond:
+            # Round up so a timer never fires before its delay has passed
+            due = self._tick() + max(1, math.ceil(delay / TICK))
+            timer = Timer(due, callback, args)
+            self._wheel.insert(timer)
+            # Only wake the thread when the new timer is the next one due
+            if self._wake_tick is None or due < self._wake_tick:
+                self._wake_tick = due
+                self._cond.notify()
+            return timer
+
+    def cancel(self, timer):
+        with self._cond:
+            self._wheel.remove(timer)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    due = self._wheel.advance(self._tick())
+                    if due:
+                        break
+                    self._wake_tick = self._wheel.next_due()
+                    if self._wake_tick is None:
+                        self._cond.wait()
+                    else:
+                        ticks = max(0, self._wake_tick - self._tick())
+                        self._cond.wait(ticks * TICK)
+                if not self._running:
+                    return
+            for timer in due:
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    print(f"Error in scheduled callback: {e}")
@@ -0,0 +1,97 @@
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+DEFAULT_TTL = 0.5  # Seconds a stat result is reused
+DEFAULT_MAX_ENTRIES = 8192
+
+
+class StatCache:
+    # Process-wide cache of os.stat() results keyed by path, shared by the
+    # handlers, notification formatting and the GUI. Entries live for a short
+    # TTL and are dropped as soon as an event arrives for their path. Missing
+    # files are cached too, as None. The stat_result carries st_ino and
+    # st_mtime_ns for consumers that key their own caches on them.
+    #
+    # os.stat() runs without the lock, so an event can arrive while it does.
+    # Each stat in flight has a generation that invalidate() withdraws; a
+    # result whose generation is gone may predate the event and is returned
+    # but not cached.
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # path -> (stat_result or None, time)
+        self._in_flight = {}  # path -> generation of its running os.stat()
+        self._generation = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stat(self, path):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and now - entry[1] < self.ttl:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            self._generation += 1
+            generation = self._in_flight[path] = self._generation
+        try:
+            result = os.stat(path)
+        except OSError:
+            result = None
+        with self._lock:
+            if self._in_flight.get(path) != generation:
+                return result  # Invalidated meanwhile, or stat()ed again
+            del self._in_flight[path]
+            self._entries[path] = (result, now)
+            self._entries.move_to_end(path)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def exists(self, path):
+        return self.stat(path) is not None
+
+    def getsize(self, path):
+        result = self.stat(path)
+        if result is None:
+            raise FileNotFoundError(path)
+        return result.st_size
+
+    def getmtime(self, path):
+        result = self.stat(path)
+        if result is None:
+            raise FileNotFoundError(path)
+        return result.st_mtime
+
+    def invalidate(self, path, dest_path=""):
+        # dest_path is a moved event's destination, "" for other events
+        if not self._entries and not self._in_flight:
+            return  # Nothing cached, skip the lock on the event path
+        with self._lock:
+            for changed in (path, dest_path) if dest_path else (path,):
+                self._in_flight.pop(changed, None)
+                if self._entries.pop(changed, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._in_flight.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+stat_cache = StatCache()
@@ -0,0 +1,122 @@
+import os
+import queue
+
+from .aggregate import OverflowSummary, RescanNotice
+from .metrics import metrics
+
+# What put() does when a bounded queue is full: "merge" folds the new item
+# into an OverflowSummary at the tail ("+N more changes"), "drop_oldest"
+# discards the head, "block" makes the emitter wait like queue.Queue.
+# RescanNotices are never merged or dropped: the engine queues at most one
+# per watcher and interval, and they may go over maxsize.
+OVERFLOW_POLICIES = ("merge", "drop_oldest", "block")
+
+
+class WakeupQueue(queue.Queue):
+    # A queue.Queue that also writes a byte to a pipe when it goes from empty
+    # to non-empty. An event loop can watch fileno() (Tk's createfilehandler,
+    # select, ...) and sleep until there is something to display, instead of
+    # polling the queue on a timer.
+    def __init__(self, maxsize=0, overflow="block"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        super().__init__(maxsize)
+        self.overflow = overflow
+        self.overflowed = 0  # put() calls that found the queue full
+        self.dropped = 0
+        self.notices = 0  # RescanNotices in the queue
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+    def fileno(self):
+        return self._wake_r
+
+    def put(self, item, block=True, timeout=None):
+        if not self.maxsize or item is None:
+            return super().put(item, block, timeout)  # None is a stop sentinel
+        if self.overflow == "block":
+            if self.full():
+                self.overflowed += 1
+                metrics.count("overflowed")
+            return super().put(item, block, timeout)
+        with self.not_full:
+            if self._qsize() < self.maxsize:
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+                return
+            self.overflowed += 1
+            metrics.count("overflowed")
+            if isinstance(item, RescanNotice) or self.notices == len(self.queue):
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+                return
+            if self.overflow == "drop_oldest":
+                del self.queue[self._unnoticed(range(len(self.queue)))]
+                self.queue.append(item)
+                self.dropped += 1
+                metrics.count("dropped")
+                return
+            # Merge: the newest notification becomes, or already is, the
+            # overflow summary
+            newest = self._unnoticed(range(len(self.queue) - 1, -1, -1))
+            tail = self.queue[newest]
+            if not isinstance(tail, OverflowSummary):
+                summary = OverflowSummary()
+                summary.add(tail)
+                self.queue[newest] = tail = summary
+            tail.add(item)
+
+    def _unnoticed(self, indexes):
+        # The first of indexes that does not hold a RescanNotice
+        for index in indexes:
+            if not isinstance(self.queue[index], RescanNotice):
+                return index
+
+    def overflow_stats(self):
+        return {
+            "maxsize": self.maxsize,
+            "policy": self.overflow,
+            "overflowed": self.overflowed,
+            "dropped": self.dropped,
+        }
+
+    def _put(self, item):
+        # Runs under the queue's mutex, so only the first item of a burst
+        # pays for the write
+        was_empty = not self.queue
+        super()._put(item)
+        if isinstance(item, RescanNotice):
+            self.notices += 1
+        if was_empty:
+            try:
+                os.write(self._wake_w, b"\0")
+            except BlockingIOError:
+                pass  # The pipe is full, the reader is awake anyway
+
+    def _get(self):
+        item = super()._get()
+        if isinstance(item, RescanNotice):
+            self.notices -= 1
+        return item
+
+    def drain(self):
+        # Clears the wakeup first and then the queue, so an item put in
+        # between is either returned now or signals the pipe again
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        items = []
+        while True:
+            try:
+                items.append(self.get_nowait())
+            except queue.Empty:
+                return items
+
+    def close(self):
+        os.close(self._wake_r)
+        os.close(self._wake_w)
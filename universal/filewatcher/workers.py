@@ -0,0 +1,154 @@
+import os
+import time
+from threading import Event, Thread
+
+# Decoupled dispatch: the observer thread only puts (handler, event) into a
+# ring buffer and goes back to reading the kernel queue. A pool of workers
+# runs the handlers: journaling, ignore rules, debouncing, building records
+# and batching. Events are spread over the workers by directory, so the
+# create, writes and close of one file are still handled in order.
+RING_SIZE = 1 << 14  # Events per worker, a power of two
+
+
+def default_workers():
+    # One per core, leaving a core for the observer thread
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+class EventRing:
+    # Single producer (the observer thread), single consumer (one worker).
+    # The producer only advances tail and the consumer only advances head,
+    # so neither takes a lock; the Event only wakes a sleeping consumer.
+    def __init__(self, size=RING_SIZE):
+        if size & (size - 1):
+            raise ValueError("Ring size must be a power of two")
+        self.slots = [None] * size
+        self.mask = size - 1
+        self.head = 0
+        self.tail = 0
+        self.waiting = False
+        self.closing = False
+        self.ready = Event()
+        self.full_waits = 0  # push() calls that had to wait for the worker
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def push(self, item):
+        while self.tail - self.head > self.mask:
+            # Full: the observer waits for the worker, as it would have
+            # waited for the handler when running it inline
+            self.full_waits += 1
+            time.sleep(0.0005)
+        self.slots[self.tail & self.mask] = item
+        self.tail += 1
+        if self.waiting:
+            self.waiting = False
+            self.ready.set()
+
+    def close(self):
+        # Wakes the consumer for good: take() returns [] once it is empty
+        self.closing = True
+        self.ready.set()
+
+    def take(self):
+        # Everything pushed so far. Sleeps without a timeout while the ring
+        # is empty, and returns [] only after close().
+        while self.tail == self.head and not self.closing:
+            self.ready.clear()
+            self.waiting = True
+            # Re-checked after announcing the wait, so a push or close() in
+            # between is either seen here or sets the event
+            if self.tail == self.head and not self.closing:
+                self.ready.wait()
+            self.waiting = False
+        head, tail = self.head, self.tail
+        count = tail - head
+        if not count:
+            return []
+        start = head & self.mask
+        end = start + count
+        slots = self.slots
+        if end <= len(slots):
+            items = slots[start:end]
+            slots[start:end] = [None] * count
+        else:
+            end -= len(slots)
+            items = slots[start:] + slots[:end]
+            slots[start:] = [None] * (len(slots) - start)
+            slots[:end] = [None] * end
+        self.head = tail  # Frees the slots for the producer
+        return items
+
+
+class DispatchPool:
+    def __init__(self, workers=None, ring_size=RING_SIZE):
+        workers = workers or default_workers()
+        self.rings = [EventRing(ring_size) for _ in range(workers)]
+        self.threads = []
+        self.running = False
+
+    def __len__(self):
+        return len(self.rings)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        for ring in self.rings:
+            ring.closing = False
+        self.threads = [
+            Thread(
+                target=self._work,
+                args=(ring,),
+                name=f"filewatcher-worker-{number}",
+                daemon=True,
+            )
+            for number, ring in enumerate(self.rings)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        # Workers finish what is already in their rings before they exit
+        self.running = False
+        for ring in self.rings:
+            ring.close()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, handler, event):
+        directory = event.src_path.rpartition(os.sep)[0]
+        self.rings[hash(directory) % len(self.rings)].push((handler, event))
+
+    def _work(self, ring):
+        while True:
+            items = ring.take()
+            if not items:
+                return  # Closed and drained
+            for handler, event in items:
+                try:
+                    handler.dispatch(event)
+                except Exception as e:
+                    print(f"Error handling {event.src_path}: {e}")
+
+    def stats(self):
+        return {
+            "workers": len(self.rings),
+            "depth": sum(len(ring) for ring in self.rings),
+            "capacity": sum(len(ring.slots) for ring in self.rings),
+            "full_waits": sum(ring.full_waits for ring in self.rings),
+        }
+
+
+class DecoupledHandler:
+    # Scheduled on the observer in place of the real handler
+    __slots__ = ("handler", "pool")
+
+    def __init__(self, handler, pool):
+        self.handler = handler
+        self.pool = pool
+
+    def dispatch(self, event):
+        self.pool.submit(self.handler, event)
@@ -0,0 +1,56 @@
+import sqlite3
+
+from filewatcher.history import HistoryIndex
+from filewatcher.journal import Journal, segment_paths
+
+
+def write(directory, events, **options):
+    journal = Journal(directory, commit_interval=0.01, **options)
+    journal.start()
+    for path, dest_path in events:
+        journal.append("/w", 0, path, dest_path)
+    journal.close()
+
+
+def test_search_under_a_folder(tmp_path):
+    write(
+        tmp_path,
+        [
+            ("/w/api/a.py", None),
+            ("/w/api/src/b.py", None),
+            ("/w/api-old/c.py", None),
+            ("/w/tmp/d.py", "/w/api/d.py"),
+        ],
+    )
+    history = HistoryIndex(tmp_path)
+    assert history.catch_up() == 4
+    entries, cursor = history.search("/w/api")
+    paths = [(entry.path, entry.dest_path) for entry in entries]
+    assert paths == [
+        ("/w/tmp/d.py", "/w/api/d.py"),
+        ("/w/api/src/b.py", None),
+        ("/w/api/a.py", None),
+    ]
+    assert cursor is None
+    assert entries[0].watcher == "/w"
+    history.close()
+
+
+def test_rows_of_deleted_segments_are_pruned(tmp_path):
+    options = {"segment_size": 4096, "retain_bytes": 20000}
+    history = HistoryIndex(tmp_path)
+    for run in range(4):
+        write(tmp_path, [(f"/b/{run}/f{i}", None) for i in range(500)], **options)
+        history.catch_up()
+    oldest = int(segment_paths(tmp_path)[0][-10:-4])
+    assert oldest > 1
+    entries, _ = history.search(limit=10000)
+    assert entries[0].path == "/b/3/f499"
+    assert len(entries) < 2000
+    connection = sqlite3.connect(history.database)
+    (first,) = connection.execute("SELECT min(name) FROM segments").fetchone()
+    (directories,) = connection.execute("SELECT count(*) FROM directories").fetchone()
+    connection.close()
+    assert first == f"events-{oldest:06d}.log"
+    assert directories <= 5
+    history.close()
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+from watchdog.events import FileSystemEventHandler
+
+from filewatcher import inotify
+from filewatcher.aggregate import ShardedAggregator
+from filewatcher.handlers import FileChangeHandler
+from filewatcher.rules import IgnoreRules
+
+pytestmark = pytest.mark.skipif(
+    not inotify.is_supported(), reason="inotify is Linux only"
+)
+
+
+class StubScheduler:
+    def call_later(self, delay, callback, *args):
+        return None
+
+
+class StubEngine:
+    def __init__(self):
+        self.aggregator = ShardedAggregator(StubScheduler(), None)
+
+
+@pytest.fixture
+def observer():
+    observer = inotify.InotifyObserver()
+    observer.start()
+    yield observer
+    observer.stop()
+    observer.join()
+
+
+def test_update_rules_twice(tmp_path, observer):
+    for path in ("a/x", "b", "c/y"):
+        os.makedirs(tmp_path / path)
+    root = str(tmp_path)
+    watch = observer.schedule(
+        FileSystemEventHandler(), root, recursive=True, prune=IgnoreRules().prunes
+    )
+    assert watch.watch_count == observer.watch_count == 6
+
+    observer.update_prune(watch, IgnoreRules([os.path.join(root, "a")]).prunes)
+    assert watch.watch_count == observer.watch_count == 4
+
+    observer.update_prune(watch, IgnoreRules([os.path.join(root, "c")]).prunes)
+    assert watch.watch_count == observer.watch_count == 4
+    assert watch.pruned == {os.path.join(root, "c")}
+    assert watch.saved_watch_count == 2
+
+    observer.unschedule(watch)
+    assert watch.watch_count == observer.watch_count == 0
+
+
+def test_saved_watch_count_follows_pruned_tree(tmp_path, observer):
+    os.makedirs(tmp_path / "node_modules" / "left")
+    root = str(tmp_path)
+    watch = observer.schedule(
+        FileSystemEventHandler(),
+        root,
+        recursive=True,
+        prune=IgnoreRules([os.path.join(root, "node_modules")]).prunes,
+    )
+    assert watch.saved_watch_count == 2
+    os.makedirs(tmp_path / "node_modules" / "right" / "deep")
+    assert watch.saved_watch_count == 4
+
+
+def test_touched_file_is_not_a_written_one(tmp_path, observer):
+    # touch gives a new file IN_ATTRIB and IN_CLOSE_WRITE but no content
+    engine = StubEngine()
+    handler = FileChangeHandler(engine, None, root=str(tmp_path), close_events=True)
+    observer.schedule(handler, str(tmp_path), recursive=True)
+    fd = os.open(tmp_path / "touched", os.O_WRONLY | os.O_CREAT)
+    os.utime(fd)  # What touch(1) does
+    os.close(fd)
+    (tmp_path / "written").write_text("x")
+    deadline = time.monotonic() + 5
+    while not engine.aggregator and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    assert len(engine.aggregator) == 1
@@ -0,0 +1,46 @@
+import os
+
+from filewatcher.journal import Journal, JournalReader, segment_paths
+
+
+def write(directory, paths, **options):
+    journal = Journal(directory, commit_interval=0.01, **options)
+    journal.start()
+    for path in paths:
+        journal.append("watcher", 0, path)
+    journal.close()
+
+
+def test_restarts_append_to_the_last_segment(tmp_path):
+    for run in range(18):
+        write(tmp_path, [f"/a/run{run}/f{i}" for i in range(100)])
+    entries = list(JournalReader(tmp_path).entries())
+    assert len(segment_paths(tmp_path)) == 1
+    assert len(entries) == 1800
+    assert entries[0].path == "/a/run0/f0"
+
+
+def test_torn_tail_is_cut_off_on_restart(tmp_path):
+    write(tmp_path, ["/a/before"])
+    segment = segment_paths(tmp_path)[0]
+    with open(segment, "ab") as file:
+        file.write(b"\x01" * 10)  # Part of a record
+    strings = os.path.join(tmp_path, "strings-000001.dat")
+    with open(strings, "ab") as file:
+        file.write(b"\x50\x00\x00\x00abc")  # Part of a string
+    write(tmp_path, ["/a/after"])
+    paths = [entry.path for entry in JournalReader(tmp_path).entries()]
+    assert paths == ["/a/before", "/a/after"]
+
+
+def test_retention_by_size(tmp_path):
+    write(
+        tmp_path,
+        [f"/b/f{i}" for i in range(2000)],
+        segment_size=4096,
+        retain_bytes=20000,
+    )
+    size = sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+    assert size <= 20000 + 4096 * 2
+    entries = list(JournalReader(tmp_path).entries())
+    assert entries[-1].path == "/b/f1999"
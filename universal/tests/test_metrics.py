@@ -0,0 +1,26 @@
+from threading import Thread
+
+from filewatcher.metrics import Metrics
+
+
+def test_counts_from_several_threads_add_up():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(50_000):
+            metrics.count("ignored")
+            metrics.record("dispatch", 1500)
+
+    threads = [Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    metrics.count("ignored")
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["ignored"] == 200_001
+    assert snapshot["counters"]["events_in"] == 200_000
+    assert snapshot["stages"]["dispatch"]["count"] == 200_000
+
+    metrics.reset()
+    assert metrics.snapshot()["counters"]["ignored"] == 0
@@ -0,0 +1,44 @@
+import os
+import threading
+
+from filewatcher.notifiers import QueuedNotifier
+from filewatcher.notify_helper import merge, read_messages
+
+
+class BlockedNotifier:
+    def __init__(self):
+        self.gate = threading.Event()
+        self.sent = []
+
+    def notify(self, title, message, file_path):
+        self.gate.wait()
+        self.sent.append(message)
+
+    def close(self):
+        pass
+
+
+def test_queued_notifier_drops_instead_of_blocking():
+    notifier = BlockedNotifier()
+    queued = QueuedNotifier(notifier, maxsize=10)
+    for i in range(50):
+        queued.notify("title", str(i), None)  # Would hang without the queue
+    notifier.gate.set()
+    queued.close()
+    assert 10 <= len(notifier.sent) <= 11
+    assert notifier.sent[:10] == [str(i) for i in range(10)]
+
+
+def test_helper_merges_what_arrived_in_one_read():
+    read_fd, write_fd = os.pipe()
+    os.write(write_fd, b'{"title": "a", "body": "1"}\n{"title": "b", "body": "2"}\n')
+    os.write(write_fd, b'{"title": "c", "bo')
+    batches = read_messages(read_fd)
+    assert [message["title"] for message in next(batches)] == ["a", "b"]
+    os.write(write_fd, b'dy": "3"}\n')
+    os.close(write_fd)
+    assert merge(next(batches)) == {"title": "c", "body": "3"}
+    assert list(batches) == []
+    os.close(read_fd)
+    merged = merge([{"title": "t", "body": f"{i}\n"} for i in range(7)])
+    assert merged == {"title": "7 notifications", "body": "0\n1\n2\n3\n4\n+2 more"}
@@ -0,0 +1,85 @@
+import os
+import time
+
+import pytest
+
+from filewatcher import inotify
+from filewatcher.handlers import BaseHandler
+from filewatcher.rescan import Rescanner
+
+pytestmark = pytest.mark.skipif(
+    not inotify.is_supported(), reason="inotify is Linux only"
+)
+
+
+def max_queued_events():
+    try:
+        with open("/proc/sys/fs/inotify/max_queued_events") as file:
+            return int(file.read())
+    except OSError:
+        return None
+
+
+class Recorder(BaseHandler):
+    def __init__(self):
+        super().__init__()
+        self.events = []
+
+    def on_any_event(self, event):
+        self.events.append(event)
+
+
+def wait_for(condition, timeout=20):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def overflow_with_directories(observer, root):
+    # Holding the observer's lock keeps it from parsing what it read, so the
+    # kernel queue fills up and the IN_CREATE of the last folders is lost
+    queued = max_queued_events()
+    if queued is None or queued > 100_000:
+        pytest.skip("inotify queue too large to overflow in a test")
+    count = queued + 300
+    with observer._lock:
+        for i in range(count):
+            os.mkdir(os.path.join(root, f"d{i}"))
+    return [os.path.join(root, f"d{i}") for i in range(count)]
+
+
+@pytest.mark.parametrize("rescan", [False, True])
+def test_folder_created_during_overflow_is_watched(tmp_path, rescan):
+    root = str(tmp_path)
+    observer = inotify.InotifyObserver()
+    handler = Recorder()
+    watch = observer.schedule(handler, root, recursive=True)
+    rescanner = None
+    if rescan:
+        rescanner = Rescanner(observer)
+        rescanner.track(root, handler, watch=watch)
+        observer.overflow_callback = lambda watches, since: rescanner.request(
+            root, since
+        )
+        rescanner.start()
+        assert wait_for(lambda: rescanner.stats())  # The baseline
+    else:
+        observer.overflow_callback = lambda watches, since: observer.refresh(watches)
+    observer.start()
+    try:
+        directories = overflow_with_directories(observer, root)
+        assert wait_for(lambda: observer.overflows)
+        assert wait_for(lambda: watch.watch_count == len(directories) + 1)
+
+        path = os.path.join(directories[-1], "written")
+        with open(path, "w") as file:
+            file.write("x")
+        assert wait_for(lambda: any(e.src_path == path for e in handler.events))
+    finally:
+        observer.stop()
+        observer.join()
+        if rescanner is not None:
+            rescanner.stop()
@@ -0,0 +1,29 @@
+import os
+
+from filewatcher import statcache
+from filewatcher.statcache import StatCache
+
+
+def test_stat_overlapping_an_invalidation_is_not_cached(tmp_path, monkeypatch):
+    path = str(tmp_path / "file")
+    with open(path, "w") as file:
+        file.write("old")
+    cache = StatCache(ttl=60)
+    real_stat = os.stat
+    calls = []
+
+    def stat_then_write(target, *args, **kwargs):
+        result = real_stat(target, *args, **kwargs)
+        calls.append(target)
+        if len(calls) == 1:
+            # The file changes and its event arrives before the result is cached
+            with open(path, "w") as file:
+                file.write("new content")
+            cache.invalidate(path)
+        return result
+
+    monkeypatch.setattr(statcache.os, "stat", stat_then_write)
+    assert cache.stat(path).st_size == 3
+    assert cache.stat(path).st_size == 11
+    assert cache.stat(path).st_size == 11
+    assert len(calls) == 2